@@ -7,6 +7,11 @@ from math import cos,radians
 try: import GetEvent
 except: from . import GetEvent
 
+# timer events: the menu sleeps in event.wait until one of these or an input event comes
+TOOLTIP = USEREVENT + 1     # no event for tooltiptime ms
+ANIMATE = USEREVENT + 2     # next frame of the sliding animation
+ANIMATE_INTERVAL = 10       # ms between frames of the sliding animation
+
 def menu(
          menu,                          # iterable of str as ("item",) or ("item::tooltip",)
          font1      = None,             # font object|None(pygame default font): unhighlighted item font
@@ -129,24 +134,21 @@ def menu(
         a = [menu[0]] if lag else menu[:]
         c = 0
         qq = show_cursor()
-        t1 = t2 = 0
+        t1 = 0
         laps = 1000./speed
-        z = []
+        clk.tick()
+        time.set_timer(ANIMATE,ANIMATE_INTERVAL)
         while a:
-            cc = clk.tick()
-            t1 += cc
-            t2 += cc
-
-            if t2 >= 20 or t1 >= laps:
-                dc = scr.blit(hold_bg_cursor,qq)
-                z.append(dc)
-                for ev in event.get():
-                    if ev.type == MOUSEMOTION:
-                        hold_rect_cursor.topleft = ev.pos
-                        hold_rect_cursor.move_ip(-hotspot[0],-hotspot[1])
-                t2 -= 20
+            ev = event.wait()
+            if ev.type == MOUSEMOTION:
+                hold_rect_cursor.topleft = ev.pos
+                hold_rect_cursor.move_ip(-hotspot[0],-hotspot[1])
+            if ev.type != ANIMATE: continue
 
-            if t1 >= laps:
+            # move the items by as many steps as are due since the last frame
+            t1 += clk.tick()
+            z = [scr.blit(hold_bg_cursor,qq)]
+            while a and t1 >= laps:
                 for i in a:
                     z.append(scr.blit(bg,i.inflate(6,6),i.inflate(6,6)))
                     i.x = i.animx.pop(0)
@@ -154,18 +156,18 @@ def menu(
                 c +=1
                 if not a[0].animx:
                     i = a.pop(0)
-                    if not lag: break
+                    if not lag: a = []
                 if lag:
                     foo,bar = divmod(c,lag)
                     if not bar and foo < len(menu):
                         a.append(menu[foo])
                 t1 -= laps
 
-            if z:
-                qq = show_cursor()
-                z.append(qq)
-                display.update(z)
-                z = []
+            qq = show_cursor()
+            z.append(qq)
+            display.update(z)
+        time.set_timer(ANIMATE,0)
+        event.clear(ANIMATE)
 
 
     def del_cursor():
@@ -228,7 +230,6 @@ def menu(
         cursor_img   = Surface((0,0))
 
     clk  = time.Clock()
-    clkt = 0
     if speed:
         for i in menu:
             z = r1.w-i.x+r1.x
@@ -248,9 +249,11 @@ def menu(
     tooltip_seen = 0
     r = show()
     dirty = ()
+    time.set_timer(TOOLTIP,max(1,tooltiptime))
     while True:
-        ev = GetEvent.poll()
-        if ev.type == NOEVENT and ev.inactiv >= tooltiptime:
+        ev = GetEvent.wait()
+        if ev.type == TOOLTIP:
+            time.set_timer(TOOLTIP,0)
             if not tooltip_seen and menu[idx].tooltip and r.collidepoint(mouse.get_pos()):
                 rr0 = del_cursor()
                 rcom = menu[idx].tooltip.get_rect(topleft=mouse.get_pos()).inflate(4,4).move(tooltip_offset).clamp(scrrect).clip(scrrect)
@@ -258,6 +261,9 @@ def menu(
                 scr.blit(menu[idx].tooltip,rcom)
                 dirty += (rr0,rcom,show_cursor())
                 tooltip_seen = 1
+        else:
+            # any other event restarts the wait for the tooltip
+            time.set_timer(TOOLTIP,max(1,tooltiptime))
         if ev.type == MOUSEMOTION:
             idx_ = Rect(ev.pos,(0,0)).collidelist(menu)
             if idx_ != idx:
@@ -289,12 +295,11 @@ def menu(
                 elif ev.key == K_ESCAPE:
                     ret = None,None
                     break
-        clkt += clk.tick(500)
         if dirty:
             display.update(dirty)
             dirty = ()
-            clkt = 0
-
+    time.set_timer(TOOLTIP,0)
+    event.clear(TOOLTIP)
 
     if tooltip_seen:
         display.update(scr.blit(combg,rcom))
@@ -4,14 +4,27 @@
 from __future__ import print_function
 import pygame, sys
 from pygame.locals import *
-import random, copy
-from time import time
+import random, copy, struct, ctypes, ctypes.util, os, json, mmap
+from array import array
+from collections import deque, OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from time import time, sleep
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    _buffer = buffer
+except NameError:
+    def _buffer(obj, offset, size):
+        return memoryview(obj)[offset:offset + size]
 
-def sample(a, p):
+def sample(a, p, rng = random):
     """Step sample from a discrete distribution using CDF
     """
     n = len(a)
-    r = random.random()
+    r = rng.random()
     total = 0           # range: [0,1]
     for i in xrange(n):
         total += p[i]
@@ -19,48 +32,876 @@ def sample(a, p):
             return a[i]
     return a[i]
 
-class World(object):
+class Sampler(object):
+    """Sampler for a fixed discrete distribution, built once with Walker's
+    alias method. A draw costs O(1) whatever the number of outcomes, and
+    draws come from the sampler's own seeded random stream.
+    """
+
+    def __init__(self, a, p, seed = None):
+        self.a = list(a)
+        self.n = n = len(self.a)
+        self.rng = random.Random(seed)
+        if numpy is not None: self.numpy_rng = numpy.random.RandomState(self.rng.getrandbits(32))
+
+        # build the alias table
+        total = float(sum(p))
+        scaled = [p_i * n / total for p_i in p]
+        self.prob, self.alias = [1.] * n, range(n)
+        small = [i for i in xrange(n) if scaled[i] < 1.]
+        large = [i for i in xrange(n) if scaled[i] >= 1.]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], l
+            scaled[l] += scaled[s] - 1.
+            if scaled[l] < 1.: small.append(l)
+            else: large.append(l)
+
+    def draw(self):
+        """Draw one value.
+        """
+        u = self.rng.random() * self.n
+        i = int(u)
+        if u - i < self.prob[i]: return self.a[i]
+        return self.a[self.alias[i]]
+
+    def draw_batch(self, size):
+        """Draw size values at once. With NumPy this is a single vectorized call
+        returning an array; otherwise a list is returned.
+        """
+        if numpy is None: return [self.draw() for i in xrange(size)]
+        u = self.numpy_rng.random_sample(size) * self.n
+        i = u.astype(int)
+        i = numpy.where(u - i < numpy.asarray(self.prob)[i], i, numpy.asarray(self.alias)[i])
+        return numpy.asarray(self.a)[i]
+
+def exact_counts(n, p, rng = random):
+    """Split n trials among the outcomes of a distribution as closely to the
+    exact proportions as possible, using largest-remainder rounding (ties
+    are broken at random).
+    """
+    total = float(sum(p))
+    quotas = [n * p_i / total for p_i in p]
+    counts = [int(q) for q in quotas]
+    by_remainder = sorted(range(len(p)), key = lambda i: (quotas[i] - counts[i], rng.random()), reverse = True)
+    for i in by_remainder[:n - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+class Design(object):
+    """The design of an experiment: the mole and animal distributions used by
+    each bundle of each block, and the length of every bundle.
+    """
+
+    WARM_UP_TRIAL_NO = 20
+
+    def __init__(self, dist_seq, bundle_length_seq, all_mole_dists, all_animal_dists):
+        assert len(dist_seq) == len(bundle_length_seq)
+        assert len(all_mole_dists) == len(all_animal_dists)
+        self.dist_seq, self.bundle_length_seq = dist_seq, bundle_length_seq
+        self.all_mole_dists, self.all_animal_dists = all_mole_dists, all_animal_dists
+        self.num_of_blocks = len(dist_seq)
+
+    def get_bundle_range(self, block):
+        """Return the bundle indices of a block.
+        """
+        if block == 'WARM_UP': return [None]
+        return range(len(self.dist_seq[block]))
+
+    def get_bundle_info(self, block, bundle_idx=None):
+        """Given a bundle index, retrieve its length, the associated distribution of mole positions,
+        and its distribution of background animals.
+        """
+        if block == 'WARM_UP':
+            bundle_length = Design.WARM_UP_TRIAL_NO
+            mole_dist = [0.25] * 4
+            animal_dist = {'rabbit': 2, 'snail': 2, 'hippo': 2, 'dinosaur': 2}
+            mole_dist_idx, animal_dist_idx = 0, 0
+        else:
+            assert type(block) is int and type(bundle_idx) is int
+            mole_dist_idx, animal_dist_idx = self.dist_seq[block][bundle_idx]
+            bundle_length = self.bundle_length_seq[block][bundle_idx]
+            mole_dist = self.all_mole_dists[mole_dist_idx]
+            animal_dist = self.all_animal_dists[animal_dist_idx]
+            
+        return bundle_length, mole_dist, animal_dist, mole_dist_idx, animal_dist_idx
+
+class Schedule(object):
+    """The mole position of every trial of a session, compiled from a seed.
+    Every play of a block (the warm up or a block that is restarted) gets new
+    positions: play p of each block is drawn from a stream derived from the
+    seed and p, so a session replays exactly from its seed. The first play of
+    all blocks is compiled before the session starts, later ones on demand.
+    """
+
+    def __init__(self, design, exact_proportion, seed = None):
+        if seed is None: seed = random.SystemRandom().randrange(2 ** 31)
+        self.seed = seed
+        self.design = design
+        self.exact_proportion = exact_proportion
+        self.holes = array('b') # the hole of every trial, bundle after bundle
+        self.bundles = [] # (play, block, bundle_idx) in schedule order
+        self.bundle_bounds = {} # (play, block, bundle_idx) -> (start, end) indices into holes
+        self.num_plays = 0 # the number of plays compiled for every block
+        self.plays = {} # block -> the number of times it was started
+        self.compile()
+
+    def compile(self):
+        """Compile the next play of all blocks.
+        """
+        play = self.num_plays
+        # the first play uses the seed itself, later ones streams derived from it
+        rng = random.Random(self.seed + (play << 64))
+        design = self.design
+        for block in ['WARM_UP'] + range(design.num_of_blocks):
+            for bundle_idx in design.get_bundle_range(block):
+                bundle_length, mole_dist = design.get_bundle_info(block, bundle_idx)[0:2]
+                hole_ids = range(len(mole_dist))
+                if self.exact_proportion:
+                    holes = []
+                    for hole_id, count in zip(hole_ids, exact_counts(bundle_length, mole_dist, rng)):
+                        holes.extend([hole_id] * count)
+                    rng.shuffle(holes)
+                else:
+                    sampler = Sampler(hole_ids, mole_dist, rng.getrandbits(32))
+                    holes = [sampler.draw() for i in xrange(bundle_length)]
+                self.bundles.append((play, block, bundle_idx))
+                self.bundle_bounds[(play, block, bundle_idx)] = (len(self.holes), len(self.holes) + len(holes))
+                self.holes.extend(holes)
+        self.num_plays += 1
+
+    def start(self, block):
+        """Start a new play of a block and return its number, compiling it
+        if no block was played as often before.
+        """
+        play = self.plays.get(block, 0)
+        self.plays[block] = play + 1
+        if play == self.num_plays: self.compile()
+        return play
+
+    def get_holes(self, play, block, bundle_idx):
+        """Return the holes of the trials of a bundle in a play.
+        """
+        start, end = self.bundle_bounds[(play, block, bundle_idx)]
+        return self.holes[start:end]
+
+    def save(self, path):
+        """Save all plays compiled so far as a CSV file.
+        """
+        with open(path, 'w') as dest:
+            print('# seed: %d' % self.seed, file=dest)
+            print('play', 'block', 'bundle', 'bundle.trial', 'which.hole', file=dest, sep=',')
+            for play, block, bundle_idx in self.bundles:
+                for bundle_trial, hole_id in enumerate(self.get_holes(play, block, bundle_idx)):
+                    print(play, block, bundle_idx, bundle_trial, hole_id, file=dest, sep=',')
+
+def _monotonic_clock():
+    """Return the best monotonic high-resolution clock available, in seconds.
+    """
+    try:
+        from time import perf_counter
+        return perf_counter
+    except ImportError:
+        pass
+    if sys.platform == 'win32':
+        # on Windows time.clock reads the performance counter
+        from time import clock
+        return clock
+    try:
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+        libc = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno = True)
+        clock_gettime = libc.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        ts = timespec()
+        CLOCK_MONOTONIC = 4 if sys.platform == 'darwin' else 1
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0: raise OSError()
+        def monotonic():
+            clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        return monotonic
+    except (OSError, AttributeError, TypeError):
+        # no monotonic clock; fall back to the wall clock
+        return time
+
+monotonic = _monotonic_clock()
+
+class GameClock(object):
+    """The clock of the game: frame ticks, and timestamps in seconds from a
+    monotonic high-resolution clock.
+    """
+
+    POLL_INTERVAL = 0.001 # seconds between calls of idle while waiting for a frame
+
+    def __init__(self):
+        self.clock = pygame.time.Clock()
+        self.last_tick = monotonic()
+
+    def tick(self, framerate = 0, idle = None):
+        """Wait out the rest of the frame and return the milliseconds since the
+        last tick. If given, idle() is called repeatedly while waiting, e.g. to
+        read input between frames.
+        """
+        if idle is None or not framerate:
+            passed = self.clock.tick(framerate)
+        else:
+            deadline = self.last_tick + 1. / framerate
+            while True:
+                idle()
+                remaining = deadline - monotonic()
+                if remaining <= 0: break
+                sleep(min(remaining, self.POLL_INTERVAL))
+            passed = self.clock.tick()
+        self.last_tick = monotonic()
+        return passed
+
+    def time(self):
+        return monotonic()
+
+    def event_time(self, event):
+        """Return when an input event happened: its own timestamp (in ms of
+        pygame.time.get_ticks) if it carries one, or else the current time.
+        """
+        now = monotonic()
+        timestamp = getattr(event, 'timestamp', None)
+        if timestamp is None: return now
+        return now - max(0, pygame.time.get_ticks() - timestamp) / 1000.
+
+    def wait(self, milliseconds):
+        pygame.time.wait(milliseconds)
+
+class VirtualClock(object):
+    """A simulated clock for running the game headless: every tick advances
+    the time by exactly one frame without waiting. If given, on_tick(now) is
+    called after every tick, e.g. to post simulated input events.
+    """
+
+    def __init__(self, on_tick = None):
+        self.now = 0.
+        self.on_tick = on_tick
+
+    def tick(self, framerate = 0, idle = None):
+        milliseconds = int(round(1000. / framerate)) if framerate else 1
+        self.now += milliseconds / 1000.
+        if self.on_tick is not None: self.on_tick(self.now)
+        if idle is not None: idle()
+        return milliseconds
+
+    def time(self):
+        return self.now
+
+    def event_time(self, event):
+        """Return when an input event happened: its timestamp in ms of virtual
+        time if it carries one, or else the current virtual time.
+        """
+        timestamp = getattr(event, 'timestamp', None)
+        if timestamp is None: return self.now
+        return timestamp / 1000.
+
+    def wait(self, milliseconds):
+        self.now += milliseconds / 1000.
+
+class InputQueue(object):
+    """The input of the game loop. While it is started, the event queue only
+    takes the event types the game uses, and poll() drains it into a queue of
+    (time, event) stamped by the clock. Events with a handler are passed to
+    handler(event, time) right away instead of being queued, so that e.g. hits
+    are detected as soon as the click is read. Poll it while waiting for the
+    next frame (see GameClock.tick) and the timing of input no longer depends
+    on how long a frame takes.
+    """
+
+    TYPES = (QUIT, KEYDOWN, MOUSEBUTTONDOWN)
+
+    def __init__(self, clock, handlers = {}, types = TYPES):
+        self.clock = clock
+        self.handlers = handlers
+        self.types = types
+        self.events = deque()
+
+    def start(self):
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(list(self.types))
+
+    def stop(self):
+        pygame.event.set_allowed(None)
+        self.events.clear()
+
+    def poll(self):
+        for event in pygame.event.get():
+            t = self.clock.event_time(event)
+            handler = self.handlers.get(event.type)
+            if handler is not None: handler(event, t)
+            else: self.events.append((t, event))
+
+    def get(self):
+        """Poll, then return the queued events in order and empty the queue.
+        """
+        self.poll()
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+class FrameProfiler(object):
+    """Time the phases of the game loop, and the interval between frames, into
+    histograms of BIN_WIDTH ms bins (the last bin takes everything longer).
+    start() starts timing a frame, mark(phase) charges the time since the
+    previous mark (or start) to the phase, and frame() is called once per
+    frame right after the clock tick. A frame more than slack ms later than
+    the framerate allows counts as a missed deadline.
+    """
+
+    BIN_WIDTH = 0.1
+    NUM_BINS = 500
+
+    def __init__(self, framerate = 60, slack = 1.):
+        self.period = 1000. / framerate
+        self.slack = slack
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.totals = {} # phase -> [count, sum of ms, max ms]
+        self.phases = [] # in order of first use
+        self.missed = 0
+        self.last = monotonic()
+        self.last_frame = None
+
+    def start(self):
+        self.last = monotonic()
+
+    def mark(self, phase):
+        now = monotonic()
+        self.add(phase, (now - self.last) * 1000.)
+        self.last = now
+
+    def frame(self):
+        now = monotonic()
+        if self.last_frame is not None:
+            interval = (now - self.last_frame) * 1000.
+            self.add('frame', interval)
+            if interval > self.period + self.slack: self.missed += 1
+        self.last_frame = now
+
+    def restart(self):
+        """Do not count the time until the next frame, e.g. between bundles.
+        """
+        self.last_frame = None
+
+    def add(self, phase, ms):
+        try:
+            histogram = self.histograms[phase]
+            totals = self.totals[phase]
+        except KeyError:
+            histogram = self.histograms[phase] = array('l', [0]) * FrameProfiler.NUM_BINS
+            totals = self.totals[phase] = [0, 0., 0.]
+            self.phases.append(phase)
+        histogram[min(int(ms / FrameProfiler.BIN_WIDTH), FrameProfiler.NUM_BINS - 1)] += 1
+        totals[0] += 1
+        totals[1] += ms
+        if ms > totals[2]: totals[2] = ms
+
+    def percentile(self, phase, q):
+        """Return the upper edge of the bin holding the q-th percentile of a phase.
+        """
+        histogram = self.histograms[phase]
+        rank, seen = q / 100. * self.totals[phase][0], 0
+        for i, count in enumerate(histogram):
+            seen += count
+            if seen >= rank and count: return (i + 1) * FrameProfiler.BIN_WIDTH
+        return FrameProfiler.NUM_BINS * FrameProfiler.BIN_WIDTH
+
+    def report(self, dest = sys.stderr):
+        """Print the count, mean, percentiles (to the bin) and maximum of every
+        phase in ms, and the number of missed deadlines.
+        """
+        print('phase', 'count', 'mean', 'p50', 'p95', 'p99', 'max', file=dest, sep='\t')
+        for phase in self.phases:
+            count, total, longest = self.totals[phase]
+            print(phase, count, '%.3f' % (total / count),
+                  *['%.1f' % min(self.percentile(phase, q), longest) for q in (50, 95, 99)] + ['%.3f' % longest],
+                  file=dest, sep='\t')
+        print('missed deadlines', self.missed, file=dest, sep='\t')
+
+    def write(self, dest, block):
+        """Write the non-empty bins of every histogram as CSV rows of block,
+        phase, bin start in ms and count, and the missed deadlines.
+        """
+        for phase in self.phases:
+            for i, count in enumerate(self.histograms[phase]):
+                if count: print(block, phase, '%.1f' % (i * FrameProfiler.BIN_WIDTH), count, file=dest, sep=',')
+        print(block, 'missed', None, self.missed, file=dest, sep=',')
+        dest.flush()
+
+class NullProfiler(object):
+    """A profiler that does nothing, for when profiling is off.
+    """
+    def reset(self): pass
+    def start(self): pass
+    def mark(self, phase): pass
+    def frame(self): pass
+    def restart(self): pass
+
+class StubSurface(object):
+    """A size-only stand-in for a Surface in headless mode. Drawing on it
+    does nothing.
+    """
+
+    def __init__(self, size):
+        self.size = tuple(size)
+
+    def get_size(self): return self.size
+    def get_width(self): return self.size[0]
+    def get_height(self): return self.size[1]
+    def get_rect(self, **kwargs): return Rect((0, 0), self.size)
+    def blit(self, source, dest, area = None, special_flags = 0):
+        return Rect(dest[0:2], area[2:4] if area else source.get_size())
+    def fill(self, color, rect = None, special_flags = 0): return self.get_rect()
+    def set_clip(self, rect = None): pass
+    def convert(self, *args): return self
+    def convert_alpha(self, *args): return self
+
+class NullSound(object):
+    """A silent stand-in for Sound and pygame.mixer.music in headless mode.
+    """
+
+    def play(self, *args, **kwargs): pass
+    def stop(self): pass
+    def fadeout(self, milliseconds): pass
+    def get_busy(self): return False
+    def load(self, path): pass
+
+def png_size(path):
+    """Read the size of a PNG image from its header without decoding it.
+    """
+    with open(path, 'rb') as f:
+        return struct.unpack('>II', f.read(24)[16:24])
+
+class AssetCache(object):
+    """Process-wide cache of converted (and scaled) surfaces, keyed by
+    (path, scale, alpha mode). Cached surfaces are shared and must not be
+    drawn on. In headless mode images are size-only stubs, which are cached
+    apart so that games drawn later in the process get real surfaces.
+    """
 
     def __init__(self):
+        self.surfaces = {}
+        self.stubs = {} # the stubs of headless mode, by the same keys
+        self.hits = 0
+        self.misses = 0
+        self.headless = False
+        self.pack = None # an AssetPack to take images from, if any
+
+    def image(self, path, scale = 1., alpha = True):
+        """Return the image at path, converted for fast blitting and scaled
+        by a factor of scale. Each image is decoded and scaled only once.
+        """
+        key = (path, scale, alpha)
+        cache = self.stubs if self.headless else self.surfaces
+        try:
+            surface = cache[key]
+            self.hits += 1
+            return surface
+        except KeyError:
+            self.misses += 1
+
+        if self.headless:
+            w, h = png_size(path)
+            surface = self.stubs[key] = StubSurface((int(scale * w), int(scale * h)))
+            return surface
+        elif self.pack is not None and self.pack.has('image', path, scale, alpha):
+            surface = self.pack.image(path, scale, alpha)
+        elif scale == 1.:
+            surface = pygame.image.load(path)
+            surface = surface.convert_alpha() if alpha else surface.convert()
+        else:
+            surface = scale_surface(self.image(path, 1., alpha), scale)
+        self.surfaces[key] = surface
+        return surface
+
+    def clear(self):
+        self.surfaces.clear()
+        self.stubs.clear()
+        self.hits, self.misses = 0, 0
+
+assets = AssetCache()
+
+class SoundBank(object):
+    """Process-wide bank of sound effects, each decoded once into a ready
+    Sound (silent in headless mode). play() logs when every play call was
+    issued, so that the latency of audio feedback can be measured.
+    """
+
+    EFFECTS = ('sounds/whack.aif', 'sounds/ticking.wav') # loaded by preload()
+    FREQUENCY = 44100
+
+    def __init__(self):
+        self.sounds = {}
+        self.null = NullSound() # played in headless mode, and never cached
+        self.plays = [] # (time, path) of every play call
+        self.buffer = None # the mixer buffer in samples, if set by pre_init
+        self.pack = None # an AssetPack to take decoded sounds from, if any
+
+    def pre_init(self, buffer = 256):
+        """Set up the mixer with a small buffer of the given number of samples
+        for low latency. Must be called before pygame.init().
+        """
+        pygame.mixer.pre_init(SoundBank.FREQUENCY, -16, 2, buffer)
+        self.buffer = buffer
+
+    def get_buffer_latency(self):
+        """Return the latency the mixer buffer adds to playback in ms, if known.
+        """
+        if self.buffer is None: return None
+        return 1000. * self.buffer / SoundBank.FREQUENCY
+
+    def preload(self, paths = EFFECTS):
+        for path in paths:
+            self.get(path)
+
+    def get(self, path):
+        """Return the sound at path, or a silent one in headless mode.
+        """
+        if assets.headless: return self.null
+        try:
+            return self.sounds[path]
+        except KeyError:
+            if self.pack is not None and self.pack.has('sound', path, pygame.mixer.get_init()):
+                sound = self.pack.sound(path)
+            else: sound = pygame.mixer.Sound(path)
+            self.sounds[path] = sound
+            return sound
+
+    def play(self, path, clock):
+        """Play the sound at path and return the time of clock when the play
+        call was issued.
+        """
+        sound = self.get(path)
+        t = clock.time()
+        sound.play()
+        self.plays.append((t, path))
+        return t
+
+    def clear(self):
+        self.sounds.clear()
+        del self.plays[:]
+
+sounds = SoundBank()
+
+class TextCache(object):
+    """Process-wide cache of fonts, one per (file, size), and of rendered text:
+    the maxsize most recently used surfaces, keyed by (font, text, color).
+    Cached surfaces are shared and must not be drawn on.
+    """
+
+    def __init__(self, maxsize = 256):
+        self.fonts = {}
+        self.surfaces = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.pack = None # an AssetPack to take rendered text from, if any
+
+    def font(self, path, size):
+        """Return the font in the file at path at the given size.
+        """
+        try:
+            return self.fonts[(path, size)]
+        except KeyError:
+            font = self.fonts[(path, size)] = pygame.font.Font(path, size)
+            return font
+
+    def render(self, path, size, text, color, antialias = True):
+        """Return the text rendered with the font in the file at path.
+        """
+        key = (path, size, text, tuple(color), antialias)
+        try:
+            surface = self.surfaces.pop(key)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            if self.pack is not None and self.pack.has('text', path, size, text, color, antialias):
+                surface = self.pack.text(path, size, text, color, antialias)
+            else:
+                surface = self.font(path, size).render(text, antialias, color)
+            if len(self.surfaces) >= self.maxsize: self.surfaces.popitem(last = False)
+        self.surfaces[key] = surface
+        return surface
+
+    def clear(self):
+        self.fonts.clear()
+        self.surfaces.clear()
+        self.hits, self.misses = 0, 0
+
+texts = TextCache()
+
+class AssetPack(object):
+    """A file of assets decoded ahead of time (see wam_pack.py): images at the
+    scales the game shows them, as raw pixels, rendered text, and sounds as
+    PCM in a given mixer format. The file is memory-mapped and buffers are
+    wrapped in place. It starts with MAGIC, the length of a JSON header and
+    the header: the entries with their keys and offsets, and the size and
+    modification time of every source file.
+    """
+
+    MAGIC = b'WTMPAK01'
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.mm[0:8] != AssetPack.MAGIC:
+            raise ValueError('%s is not an asset pack' % path)
+        header_len = struct.unpack('<I', self.mm[8:12])[0]
+        self.header = json.loads(self.mm[12:12 + header_len].decode('utf-8'))
+        self.data_offset = 12 + header_len # entry offsets count from here
+        self.entries = dict((AssetPack.key(*entry['key']), entry) for entry in self.header['entries'])
+
+    @staticmethod
+    def key(kind, *args):
+        """Return the key of an entry, with lists (e.g. colors) made hashable.
+        """
+        return (kind,) + tuple(tuple(a) if isinstance(a, list) else a for a in args)
+
+    @staticmethod
+    def open(path):
+        """Return the pack at path, or None if there is none or if any of its
+        source files changed since it was built.
+        """
+        if not os.path.exists(path): return None
+        try:
+            pack = AssetPack(path)
+        except (ValueError, IOError, EnvironmentError) as e:
+            print('ignoring the asset pack:', e, file=sys.stderr)
+            return None
+        if pack.is_stale():
+            print('ignoring the asset pack %s: its sources changed since it was built' % path, file=sys.stderr)
+            return None
+        return pack
+
+    def is_stale(self):
+        for path, (size, mtime) in self.header['sources'].items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                return True
+            if st.st_size != size or int(st.st_mtime) != mtime: return True
+        return False
+
+    def has(self, *key):
+        return AssetPack.key(*key) in self.entries
+
+    def get_buffer(self, entry):
+        return _buffer(self.mm, self.data_offset + entry['offset'], entry['length'])
+
+    def image(self, path, scale, alpha):
+        entry = self.entries[AssetPack.key('image', path, scale, alpha)]
+        surface = pygame.image.frombuffer(self.get_buffer(entry), entry['size'], entry['format'])
+        return surface.convert_alpha() if alpha else surface.convert()
+
+    def text(self, path, size, text, color, antialias):
+        entry = self.entries[AssetPack.key('text', path, size, text, color, antialias)]
+        return pygame.image.frombuffer(self.get_buffer(entry), entry['size'], entry['format'])
+
+    def sound(self, path):
+        entry = self.entries[AssetPack.key('sound', path, pygame.mixer.get_init())]
+        return pygame.mixer.Sound(buffer = self.get_buffer(entry))
+
+def use_asset_pack(path):
+    """Take images, text and sounds from the asset pack at path, if it exists
+    and is up to date. Otherwise they keep being loaded from the loose files.
+    """
+    pack = AssetPack.open(path)
+    assets.pack = texts.pack = sounds.pack = pack
+    return pack
+
+def image_manifest():
+    """Return the (path, scale, alpha mode) of every image the world shows,
+    at the scale it is shown at, derived from the entity classes.
+    """
+    keys = [(World.background_path, 1., False), (Mole.bang_image_path, Mole.bang_scale, True)]
+    classes = [GameEntity]
+    while classes:
+        cls = classes.pop(0)
+        classes.extend(cls.__subclasses__())
+        if cls.image_path is None: continue
+        key = (cls.image_path, cls.scale, True)
+        if key not in keys: keys.append(key)
+    return keys
+
+def decode_asset(job):
+    """Decode an asset off the main thread: an image, also scaled by each of
+    the given factors, or a sound. Return (kind, path, result), where the
+    result of an image is its unconverted surfaces by scale.
+    """
+    kind, path, scales = job
+    if kind == 'sound':
+        return kind, path, pygame.mixer.Sound(path)
+    image = pygame.image.load(path)
+    surfaces = {1.: image}
+    # smoothscale needs 24 or 32 bit surfaces; others are scaled once converted
+    if image.get_bitsize() >= 24:
+        for scale in scales:
+            if scale != 1.: surfaces[scale] = scale_surface(image, scale)
+    return kind, path, surfaces
+
+def load_assets(images, effects = SoundBank.EFFECTS, progress = None, threads = None):
+    """Cache the images, given as (path, scale, alpha mode), and the sound
+    effects, decoding and scaling them on a pool of threads. pygame releases
+    the GIL while it decodes and scales, so this takes about as long as the
+    largest asset with enough cores. Only the conversion to the display
+    format is done here, on the thread that owns the display. Assets in the
+    asset pack are taken from it instead. progress(done, total) is called
+    as assets come in.
+    """
+    if assets.headless: return
+    mixer = pygame.mixer.get_init()
+    scales = OrderedDict()
+    for path, scale, alpha in images:
+        if (path, scale, alpha) in assets.surfaces: continue
+        if assets.pack is not None and assets.pack.has('image', path, scale, alpha): continue
+        scales.setdefault(path, set()).add(scale)
+    jobs = [('image', path, sorted(s)) for path, s in scales.items()]
+    if mixer is not None:
+        jobs += [('sound', path, None) for path in effects if path not in sounds.sounds and
+                 not (sounds.pack is not None and sounds.pack.has('sound', path, mixer))]
+    total = len(jobs)
+    if progress is not None: progress(0, total)
+    if jobs:
+        pool = ThreadPool(min(len(jobs), threads or cpu_count()))
+        try:
+            for done, (kind, path, result) in enumerate(pool.imap_unordered(decode_asset, jobs), 1):
+                if kind == 'sound':
+                    sounds.sounds[path] = result
+                else:
+                    for key in images:
+                        if key[0] == path and key[1] in result and key not in assets.surfaces:
+                            surface = result[key[1]]
+                            assets.surfaces[key] = surface.convert_alpha() if key[2] else surface.convert()
+                            assets.misses += 1
+                if progress is not None: progress(done, total)
+        finally:
+            pool.close()
+            pool.join()
+    # whatever is left comes from the asset pack or is scaled after conversion
+    for key in images:
+        assets.image(*key)
+    sounds.preload(effects)
+
+class World(object):
+
+    # the layers of the entities: everything on the static layer is baked
+    # into one surface, which is only rebuilt when those entities change
+    STATIC_LAYER, SCORE_LAYER, MOLE_LAYER = 0, 1, 2
+    PLACEMENT_ATTEMPTS = 20 # arrangements of the animals tried before keeping the current one
+    background_path = 'images/background-hi.png'
+
+    def __init__(self, clock = None):
         """Constructor for the World.
         """
         self.entities = pygame.sprite.LayeredUpdates()
         self.animals = pygame.sprite.LayeredUpdates()
-        self.background = pygame.image.load('images/background-hi.png').convert()
+        self.background = assets.image(World.background_path, alpha = False)
         self.hole_positions = None
         self.score = 0
         self.mole = None
         self.mole_dist = None
+        self.animal_pool = {} # animal name -> animal entities built so far
+        self.layouts = {} # animal distribution -> a layout known to fit, as (animal, rect)
+        self.redraw = True # force a full redraw on the next dirty-rect render
+        self.static = None # the background with the static layer drawn on it
+        self.rebuild = True # rebuild the static surface on the next render
+        self.dynamic = [] # the entities above the static layer, in drawing order
+        self.clock = clock if clock is not None else GameClock()
         
-        pygame.mixer.music.load("sounds/background.mp3")
+        self.music = NullSound() if assets.headless else pygame.mixer.music
+        self.music.load("sounds/background.mp3")
 
     def add_mole(self, mole_dist):
         """Add the mole to the world.
         """
         if self.mole is None:
             mole = Mole(world = self)
-            mole.scale_image(.15)
             self.add_entity(mole)
         self.mole_dist = mole_dist
         
-    def add_animals(self, animal_dist):
-        """Add animals to the world.
+    def reserve_animals(self, animal_dist):
+        """Make sure the animal pool holds enough animals of each species
+        for a given animal distribution, and that they fit in the world.
+        Raise a ValueError if no arrangement of them is found.
         """
-        # add animals
         animal_classes = {'cat': Cat, 'dinosaur': Dinosaur,
                           'hippo': Hippo, 'rabbit': Rabbit,
                           'snail': Snail}
 
+        animals = []
+        for animal, count in animal_dist.iteritems():
+            pool = self.animal_pool.setdefault(animal, [])
+            while len(pool) < count:
+                pool.append(animal_classes[animal](self))
+            animals.extend(pool[:count])
+
+        # the check draws from its own random stream, so that it does not
+        # change the arrangements of the session
+        key = tuple(sorted(animal_dist.items()))
+        if key not in self.layouts:
+            rects = self.place_animals(animals, random.Random(0))
+            if rects is None:
+                raise ValueError('the animals of %s do not fit in the world' % animal_dist)
+            self.layouts[key] = zip(animals, rects)
+        return key
+
+    def add_animals(self, animal_dist):
+        """Add animals to the world. Animals are taken from the pool, which is
+        only extended if it has not been reserved for this distribution.
+        """
+        key = self.reserve_animals(animal_dist)
+
         # empty existing animals
         self.entities.remove(self.animals.sprites())
         self.animals.empty()
+        self.redraw = self.rebuild = True
 
         # add new animals
         for animal, count in animal_dist.iteritems():
+            pool = self.animal_pool[animal]
             for i in xrange(count):
-                d = animal_classes[animal](self)
-                d.scale_image(.115)
-                self.add_entity(d)
+                self.add_entity(pool[i])
+        # the animals start out in the layout found when they were reserved
+        for animal, rect in self.layouts[key]:
+            animal.rect = Rect(rect)
+
+    def place_animals(self, animals, rng = random):
+        """Return a free position for each of the animals, where it does not
+        overlap any other entity or animal, or None if no arrangement is found
+        in PLACEMENT_ATTEMPTS tries.
+        """
+        for attempt in xrange(World.PLACEMENT_ATTEMPTS):
+            index = PlacementIndex(Animal.placement_area)
+            for entity in self.entities:
+                if entity.type != 'animal': index.add(entity.rect)
+            rects = []
+            for animal in animals:
+                rect = index.sample(animal.image.get_size(), rng)
+                if rect is None: break
+                index.add(rect)
+                rects.append(rect)
+            else:
+                return rects
+        return None
+
+    def arrange_animals(self):
+        """Move every animal to a random position where it does not overlap
+        any other entity or the animals placed before it. If no arrangement is
+        found, the animals keep their current layout. Return whether they
+        were moved.
+        """
+        animals = self.animals.sprites()
+        rects = self.place_animals(animals)
+        if rects is None: return False
+        for animal, rect in zip(animals, rects):
+            animal.rect = rect
+        self.rebuild = True
+        return True
 
     def add_scorebar(self):
         """Add the score bar to the world.
@@ -83,49 +924,122 @@ class World(object):
         if entity.type == 'mole': self.mole = entity
         if entity.type == 'animal': self.animals.add(entity)
         self.entities.add(entity)
+        self.redraw = self.rebuild = True
 
-    def render(self, surface):
-        """Render the world on a given surface.
+    def invalidate(self):
+        """Force the next dirty-rect render to redraw the whole world,
+        e.g. after something else has been drawn on the screen.
         """
-        surface.blit(self.background, (0,0))
-        for entity in [e for e in self.entities if e.type != 'mole']:
-            entity.render(surface)
-        self.mole.render(surface)
-        
+        self.redraw = True
+
+    def is_changed(self):
+        """Return whether rendering the world now would change anything on
+        the screen since it was last rendered.
+        """
+        if self.redraw or self.rebuild: return True
+        for entity in self.dynamic:
+            if entity.get_dirty_rects(): return True
+        return False
+
+    def get_static(self):
+        """Return the background with all entities of the static layer drawn
+        on it, rebuilding it if they changed.
+        """
+        if self.rebuild:
+            if self.static is None: self.static = self.background.copy()
+            else: self.static.blit(self.background, (0,0))
+            for entity in self.entities.get_sprites_from_layer(World.STATIC_LAYER):
+                entity.render(self.static)
+            self.dynamic = [e for layer in self.entities.layers() if layer > World.STATIC_LAYER
+                            for e in self.entities.get_sprites_from_layer(layer)]
+            self.rebuild = False
+        return self.static
+
+    def render(self, surface, dirty = False):
+        """Render the world on a given surface and return the list of regions
+        that were drawn. In dirty-rect mode only the regions reported as changed
+        by the entities are redrawn.
+        """
+        if not dirty or self.redraw:
+            surface.blit(self.get_static(), (0,0))
+            for entity in self.dynamic:
+                entity.render(surface)
+            self.redraw = False
+            return [surface.get_rect()]
+
+        rects = []
+        # static entities can only have changed if the static layer is rebuilt
+        if self.rebuild:
+            for entity in self.entities.get_sprites_from_layer(World.STATIC_LAYER):
+                rects.extend(entity.get_dirty_rects())
+        static = self.get_static()
+        for entity in self.dynamic:
+            rects.extend(entity.get_dirty_rects())
+        rects = merge_rects(rects)
+
+        # redraw the dynamic entities that overlap a changed region, clipped to that region
+        for rect in rects:
+            surface.set_clip(rect)
+            surface.blit(static, rect, rect)
+            for entity in self.dynamic:
+                entity.render(surface)
+        surface.set_clip(None)
+        return rects
+
 class GameEntity(pygame.sprite.Sprite):
+
+    image_path = None # set by entities whose image comes from the asset cache
+    scale = 1. # the scale the image is shown at in the world
+    _layer = World.STATIC_LAYER # the layer of the world the entity is drawn on
     
-    def __init__(self, world, name, image):
-        '''Construtor for GameEntity'''
+    def __init__(self, world, name, image, image_scale = 1.):
+        '''Construtor for GameEntity, whose image is at image_scale'''
         pygame.sprite.Sprite.__init__(self)
         
         self.world = world
         self.name = name
         self.image = image
+        self.image_scale = image_scale
         self.rect = self.image.get_rect()
         self.destination = (0.,0.)
         self.visible = True
         self.speed = 0.
         self.type = 'regular'
+        self.drawn_rect = None # the region covered the last time the entity was rendered
 
     def scale_image(self, percent):
-        w, h = self.image.get_size()
-        self.image = pygame.transform.smoothscale(self.image, (int(percent * w), int(percent * h)))
+        self.image_scale *= percent
+        if self.image_path is None:
+            w, h = self.image.get_size()
+            self.image = pygame.transform.smoothscale(self.image, (int(percent * w), int(percent * h)))
+        else:
+            self.image = assets.image(self.image_path, self.image_scale)
         self.rect = self.image.get_rect()
            
+    def get_draw_rect(self):
+        """Return the region the entity covers when rendered now.
+        """
+        return Rect(self.rect[0:2], self.image.get_size())
+
+    def get_dirty_rects(self):
+        """Return the regions that changed since the entity was last rendered.
+        """
+        return changed_rects(self.drawn_rect, self.get_draw_rect())
+           
     def render(self, surface):
         
-        x, y = self.rect[0:2]
-        w, h = self.image.get_size()
-        surface.blit(self.image, (x, y))
+        self.drawn_rect = self.get_draw_rect()
+        surface.blit(self.image, self.drawn_rect)
 
 class Hole(GameEntity):
+
+    image_path = 'images/hole.png'
+    scale = .6
     
     def __init__(self, world, hole_id):
 
-        hole_image = pygame.image.load('images/hole.png').convert_alpha()
-        GameEntity.__init__(self, world, 'hole', hole_image)
+        GameEntity.__init__(self, world, 'hole', assets.image(Hole.image_path, Hole.scale), Hole.scale)
 
-        self.scale_image(.6)
         self.world.hole_size = self.image.get_size()
         self.hole_id = hole_id
         self.set_position()
@@ -136,62 +1050,130 @@ class Hole(GameEntity):
 
 class Mole(GameEntity):
 
+    image_path = 'images/mole.png'
+    scale = .15
+    bang_image_path = 'images/bang.png'
+    bang_scale = .5
+    bang_sound_path = 'sounds/whack.aif'
+    _layer = World.MOLE_LAYER
+
+    # states of the mole
+    STILL, MOVE_UP, MOVE_DOWN = 0, 1, 2
+    motion_tables = {} # (speed, distance): offsets by ms, shared by all moles
+
     def __init__(self, world):
         """Initializing a mole.
         """        
-        mole_image = pygame.image.load('images/mole.png').convert_alpha()
-        GameEntity.__init__(self, world, 'mole', mole_image)
+        GameEntity.__init__(self, world, 'mole', assets.image(Mole.image_path, Mole.scale), Mole.scale)
         self.type = 'mole'
         self.visible = False
         self.upspeed = 240
         self.downspeed = 290
         self.current_hole_id = -1
-        self.status = 'STILL'
+        self.status = Mole.STILL
+        self.motion = None # the offsets of the current rise or fall, by ms
+        self.motion_y = 0 # where the current rise or fall started
+        self.motion_time = 0 # ms since the current rise or fall started
         self.moved = 0 # the number of times the mole has been moved
         self.locked = False
         self.locked_duration = 0
         self.max_locked_duration = 2000
         self.hit_locked_duration = 300
-        self.bang_image = pygame.image.load('images/bang.png').convert_alpha()
-        self.bang_image = scale_surface(self.bang_image, 0.5)
-        self.bang_sound = pygame.mixer.Sound('sounds/whack.aif')
+        self.bang_image = assets.image(Mole.bang_image_path, Mole.bang_scale)
         self.whacked = False
         self.rel_whack_coordinates = (None, None)
         self.bang_pos = (0,0)
-        self.begin_time = None
-        self.end_time = None
+        self.drawn_bang_rect = None
+        self.begin_time = None # when the mole was moved to its hole
+        self.onset_time = None # when the mole was first shown on the display
+        self.reveal_time = None # when the mole was first shown fully risen
+        self.risen = False
+        self.end_time = None # when the mole was whacked
+        self.sound_time = None # when the bang sound was started
 
     def move_to_hole(self, hole_id, verbose = False):
         if self.visible: return
         self.rect[0] = self.world.hole_positions[hole_id][0] + 50
         self.rect[1] = self.world.hole_positions[hole_id][1] + 25
         self.current_hole_id = hole_id
+        self.status = Mole.STILL
+        self.motion_time = 0
         self.whacked = False
         if verbose: print('mole moved to hole', self.current_hole_id)
-        self.begin_time = time()
+        self.begin_time = self.world.clock.time()
+        self.onset_time = None
+        self.reveal_time = None
+        self.risen = False
+        self.end_time = None
+        self.sound_time = None
         return
 
-    def move_weighted(self, verbose = False):
-        """Move the mole to a hole according the appearance probabilities.
+    def mark_displayed(self, t = None):
+        """Stamp the onset of the mole at time t (by default now) if it is shown
+        for the first time, and its reveal if it is first shown fully risen.
+        Called right after every display update.
         """
-        hole_id = sample(a = range(4), p = self.world.mole_dist)
-        self.move_to_hole(hole_id, verbose)
+        if self.reveal_time is not None: return
+        if self.onset_time is None:
+            rect = self.get_draw_rect()
+            if rect is None or rect.height == 0: return
+            self.onset_time = self.world.clock.time() if t is None else t
+        if self.risen:
+            self.reveal_time = self.world.clock.time() if t is None else t
 
-    def show(self, time_passed):
+    @staticmethod
+    def get_motion_table(speed, distance):
+        """Return how far a mole moving at speed pixels per second has gone
+        after each ms of a motion over distance pixels. The last entry is the
+        distance, reached after len(table) - 1 ms.
+        """
+        key = (speed, distance)
+        try:
+            return Mole.motion_tables[key]
+        except KeyError:
+            table = array('h', [0])
+            while table[-1] < distance:
+                table.append(min(distance, int(speed * len(table) / 1000.)))
+            Mole.motion_tables[key] = table
+            return table
+
+    def get_top(self):
+        """Return the y of the mole when it has fully risen.
+        """
+        return self.world.hole_positions[self.current_hole_id][1] + 27 - self.image.get_height()
 
+    def get_bottom(self):
+        """Return the y of the mole when it is hidden in its hole.
+        """
+        return self.world.hole_positions[self.current_hole_id][1] + 25
+
+    def start_motion(self, status, speed, distance):
+        self.status = status
+        self.motion = Mole.get_motion_table(speed, distance)
+        self.motion_y = self.rect[1]
+
+    def show(self, time_passed):
+        """Raise the mole as a function of the time since it started rising.
+        """
         if self.current_hole_id == -1: return
-        if self.status == 'MOVE_DOWN' or self.locked: return
+        if self.status == Mole.MOVE_DOWN or self.locked: return
         self.visible = True
 
-        w, h = self.image.get_size()
-        
-        if self.rect[1] + h - 28 < self.world.hole_positions[self.current_hole_id][1]:
-            self.status = 'STILL'
+        if self.status == Mole.STILL:
+            self.start_motion(Mole.MOVE_UP, self.upspeed, self.rect[1] - self.get_top())
+            self.motion_time = 0
+        self.motion_time += time_passed
+        duration = len(self.motion) - 1
+        if self.motion_time >= duration:
+            self.rect[1] = self.motion_y - self.motion[duration]
+            self.status = Mole.STILL
             self.locked = True
+            self.risen = True
+            # wait() adds the time of this frame next, of which only the part
+            # after the mole reached the top counts
+            self.locked_duration = self.motion_time - duration - time_passed
         else:
-            self.status = 'MOVE_UP'
-            seconds = time_passed / 1000.
-            self.rect[1] = self.rect[1] - max(1, self.upspeed * seconds)
+            self.rect[1] = self.motion_y - self.motion[self.motion_time]
 
     def wait(self, time_passed):
         if self.current_hole_id == -1: return
@@ -204,59 +1186,85 @@ class Mole(GameEntity):
 
         if self.locked_duration > max_duration:
             self.locked = False
+            # the part of the frame after the lock ran out counts towards the fall
+            self.motion_time = self.locked_duration - max_duration
             self.locked_duration = 0
 
     def hide(self, time_passed):
+        """Lower the mole as a function of the time since it started falling.
+        """
         if self.current_hole_id == -1: return
-        if self.status == 'MOVE_UP' or self.locked: return
-        w, h = self.image.get_size()
+        if self.status == Mole.MOVE_UP or self.locked: return
 
-        if self.rect[1] - 25 >= self.world.hole_positions[self.current_hole_id][1]:
-            self.status = 'STILL'
+        if self.status == Mole.STILL:
+            self.start_motion(Mole.MOVE_DOWN, self.downspeed, max(0, self.get_bottom() - self.rect[1]))
+        else:
+            self.motion_time += time_passed
+        duration = len(self.motion) - 1
+        if self.motion_time >= duration:
+            self.rect[1] = self.motion_y + self.motion[duration]
+            self.status = Mole.STILL
             self.visible = False
-            #self.moved += 1
         else:
-            self.status = 'MOVE_DOWN'
-            seconds = time_passed / 1000.
-            self.rect[1] = self.rect[1] + max(1, self.downspeed * seconds)
+            self.rect[1] = self.motion_y + self.motion[self.motion_time]
 
     def moveable(self):
         return not self.visible
 
-    def get_whacked(self, mouse_x, mouse_y):
-        """Detect if the mole is whacked when the method is called.
+    def get_whacked(self, mouse_x, mouse_y, t = None):
+        """Detect if the mole is whacked by a click at time t (by default now).
+        Clicks before the mole was first shown on the display do not count.
         """
         if self.whacked: return
+        if not self.visible or self.onset_time is None: return
+        if t is None: t = self.world.clock.time()
+        if t <= self.onset_time: return
         mole_x, mole_y, mole_w, mole_h = self.rect
         self.whacked = mouse_x > mole_x and mouse_x < mole_x + mole_w and mouse_y > mole_y and mouse_y < mole_y + mole_h
         
         if self.whacked:
-            self.end_time = time()
-            self.bang_sound.play()
+            self.end_time = t
+            self.sound_time = sounds.play(Mole.bang_sound_path, self.world.clock)
             self.locked_duration = 0
             self.locked = self.whacked
-            self.status = 'STILL'
+            self.status = Mole.STILL
 
             self.rel_whack_coordinates = (mouse_x - mole_x, mouse_y - mole_y)
             bang_center = (mouse_x, mouse_y)# (mole_x + mole_w / 2, mole_y + mole_h / 2)
             bang_size = self.bang_image.get_size()
             self.bang_pos = (bang_center[0] - bang_size[0] / 2, bang_center[1] - bang_size[1] / 2)
 
-            self.world.score += int(5.0 * 1000.0 / float(self.get_alive_time()))
+            # scored on the exact interval: click timestamps have ms resolution,
+            # so a reaction time can round down to 0 ms
+            self.world.score += int(5.0 / (self.end_time - self.onset_time))
 
             return self.whacked
 
-    def show_hammered_image(self, surface):
+    def get_bang_rect(self):
+        if not self.whacked: return None
+        return Rect(self.bang_pos, self.bang_image.get_size())
+
+    def show_hammered_image(self, surface, areas = None):
+        """Draw the bang image, restricted to the given regions if any (the bang
+        is translucent, so it must not be drawn twice over the same pixels).
+        """
+        self.drawn_bang_rect = self.get_bang_rect()
         if not self.whacked: return
-        surface.blit(self.bang_image, self.bang_pos)
+        if areas is None:
+            surface.blit(self.bang_image, self.bang_pos)
+            return
+        for area in areas:
+            surface.set_clip(area)
+            surface.blit(self.bang_image, self.bang_pos)
+        surface.set_clip(None)
 
     def get_alive_time(self):
-        """Return how long the mole was active before getting hammered.
-        Return none if player missed.
+        """Return how long the mole was shown before getting hammered, in ms
+        from its onset. Return none if player missed.
         """
         if self.whacked: 
             try:
-                td = self.end_time - self.begin_time
+                td = self.end_time - self.onset_time
                 alive_time = int(round(td * 1000))
             except:
                 alive_time = None
@@ -264,79 +1272,223 @@ class Mole(GameEntity):
         else: 
             return
 
-    def render(self, surface):
-        if self.visible is False: return
-        hole_w, hole_h = self.world.hole_size
+    def get_reveal_time(self):
+        """Return how long the mole took to rise fully from its onset, in ms.
+        Return none if it was hit before.
+        """
+        if self.reveal_time is None or self.onset_time is None: return
+        return int(round((self.reveal_time - self.onset_time) * 1000))
+
+    def get_draw_rect(self):
+        """Return the part of the mole above its hole, or None if it is hidden.
+        """
+        if self.visible is False: return None
         hole_x, hole_y = self.world.hole_positions[self.current_hole_id]
         mole_x, mole_y, mole_w, mole_h = self.rect
-        drawable = Rect(0, 0, mole_w, max(hole_y + 25 - mole_y, 0))
+        return Rect(mole_x, mole_y, mole_w, max(hole_y + 25 - mole_y, 0))
+
+    def get_dirty_rects(self):
+        """Return the regions covered by the mole and the bang image that
+        changed since they were last drawn.
+        """
+        return (changed_rects(self.drawn_rect, self.get_draw_rect()) +
+                changed_rects(self.drawn_bang_rect, self.get_bang_rect()))
+
+    def render(self, surface):
+        self.drawn_rect = self.get_draw_rect()
+        if self.drawn_rect is None: return
+        mole_x, mole_y, mole_w, drawable_h = self.drawn_rect
+        drawable = Rect(0, 0, mole_w, drawable_h)
         surface.blit(self.image, dest=(mole_x, mole_y), area=drawable)
     
 class Animal(GameEntity):
+
+    # animals are placed with their whole image inside this region
+    placement_area = Rect(0, 400, 990, 324)
+    scale = .115
     
     def __init__(self, world, name, image):
-        GameEntity.__init__(self, world, name, image)
+        GameEntity.__init__(self, world, name, image, self.scale)
         self.type = 'animal'
 
-    def auto_location(self):
-        """Move the animal to a random new position in the world.
+    def auto_location(self, index = None):
+        """Move the animal to a random free position in the world. The index
+        of occupied regions is built from all other entities unless given.
+        Raise a RuntimeError if there is no room for the animal.
         """
-        c = True
-        while c:
-            w, h = self.image.get_size()
-            min_x, min_y, max_x, max_y = (0, 400, 1000-w-10, 734-h-10)
-            x, y = (random.randint(min_x, max_x), random.randint(min_y,max_y))
-        
-            self.rect = Rect(x, y, w, h)
-            c = pygame.sprite.spritecollide(self, self.world.entities, False)
-            c.remove(self)
+        if index is None:
+            index = PlacementIndex(Animal.placement_area)
+            for entity in self.world.entities:
+                if entity is not self: index.add(entity.rect)
+
+        rect = index.sample(self.image.get_size())
+        if rect is None:
+            raise RuntimeError('no room left to place the %s' % self.name)
+        self.rect = rect
+        index.add(rect)
 
 class Cat(Animal):
-    
+
+    image_path = 'images/cat.png'
+
     def __init__(self, world):
-        cat_image = pygame.image.load('images/cat.png').convert_alpha()
-        Animal.__init__(self, world, 'cat', cat_image)
+        Animal.__init__(self, world, 'cat', assets.image(Cat.image_path, Cat.scale))
 
 class Dinosaur(Animal):
-    
+
+    image_path = 'images/dinosaur.png'
+
     def __init__(self, world):
-        dinosaur_image = pygame.image.load('images/dinosaur.png').convert_alpha()
-        Animal.__init__(self, world, 'dinosaur', dinosaur_image)
+        Animal.__init__(self, world, 'dinosaur', assets.image(Dinosaur.image_path, Dinosaur.scale))
         
 class Hippo(Animal):
-    
+
+    image_path = 'images/hippo.png'
+
     def __init__(self, world):
-        hippo_image = pygame.image.load('images/hippo.png').convert_alpha()
-        Animal.__init__(self, world, 'hippo', hippo_image)
+        Animal.__init__(self, world, 'hippo', assets.image(Hippo.image_path, Hippo.scale))
 
 class Rabbit(Animal):
-    
+
+    image_path = 'images/rabbit.png'
+
     def __init__(self, world):
-        rabbit_image = pygame.image.load('images/rabbit.png').convert_alpha()
-        Animal.__init__(self, world, 'rabbit', rabbit_image)
+        Animal.__init__(self, world, 'rabbit', assets.image(Rabbit.image_path, Rabbit.scale))
 
 class Snail(Animal):
 
+    image_path = 'images/snail.png'
+
     def __init__(self, world):
-        snail_image = pygame.image.load('images/snail.png').convert_alpha()
-        Animal.__init__(self, world, 'snail', snail_image)
+        Animal.__init__(self, world, 'snail', assets.image(Snail.image_path, Snail.scale))
 
 class ScoreBar(GameEntity):
 
+    FONT = ('data/intuitive.ttf', 32)
+    _layer = World.SCORE_LAYER
+
     def __init__(self, world):
         
         self.color = (0,0,0)
-        self.font = pygame.font.Font('data/intuitive.ttf', 32)
-        scoreimage = self.font.render('Score: ' + str(world.score), True, self.color)
-        GameEntity.__init__(self, world, 'scorebar', scoreimage)
-        self.rect = Rect([750,60], self.image.get_size())
+        # the score is drawn from a label and per-digit glyphs, rendered once
+        self.label = texts.render(*ScoreBar.FONT + ('Score: ', self.color))
+        self.glyphs = dict((d, texts.render(*ScoreBar.FONT + (d, self.color))) for d in '0123456789')
+        # glyphs may be taller than the label
+        self.text_height = max(g.get_height() for g in self.glyphs.values() + [self.label])
+        GameEntity.__init__(self, world, 'scorebar', self.label)
+        self.rect = Rect([750,60], self.get_text_size(world.score))
+        self.drawn_score = None
+
+    def get_text_size(self, score):
+        w = self.label.get_width()
+        for d in str(score):
+            w += self.glyphs[d].get_width()
+        return w, self.text_height
+
+    def get_draw_rect(self):
+        return Rect(self.rect[0:2], self.get_text_size(self.world.score))
+
+    def get_dirty_rects(self):
+        if self.drawn_score == self.world.score: return []
+        text_rect = self.get_draw_rect()
+        if self.drawn_rect is None: return [text_rect]
+        # the text changes even if its size does not
+        return [self.drawn_rect.union(text_rect)]
 
     def render(self, surface):
 
-        self.image = self.font.render('Score: ' + str(self.world.score), True, self.color)
+        self.drawn_rect = self.get_draw_rect()
+        self.drawn_score = self.world.score
         x, y = self.rect[0:2]
-        w, h = self.image.get_size()
-        surface.blit(self.image, (x, y))
+        surface.blit(self.label, (x, y))
+        x += self.label.get_width()
+        for d in str(self.world.score):
+            glyph = self.glyphs[d]
+            surface.blit(glyph, (x, y))
+            x += glyph.get_width()
+
+class PlacementIndex(object):
+    """Index of the occupied regions of a placement area. Positions for new
+    rects are drawn uniformly from the free space in bounded time, instead of
+    by rejection sampling.
+    """
+
+    def __init__(self, area):
+        self.area = Rect(area)
+        self.occupied = []
+
+    def add(self, rect):
+        rect = Rect(rect)
+        # like pygame collisions, empty regions never collide
+        if rect.w > 0 and rect.h > 0: self.occupied.append(rect)
+
+    def sample(self, size, rng = random):
+        """Return a rect of the given size at a random position inside the area
+        that does not collide with any occupied region, or None if there is no
+        such position.
+        """
+        w, h = size
+        # the range of valid top-left corners, as half-open intervals
+        x0, x1 = self.area.left, self.area.right - w + 1
+        y0, y1 = self.area.top, self.area.bottom - h + 1
+        if x1 <= x0 or y1 <= y0: return None
+
+        # each occupied region rules out a box of top-left corners
+        boxes = []
+        for r in self.occupied:
+            bx0, bx1 = max(r.left - w + 1, x0), min(r.right, x1)
+            by0, by1 = max(r.top - h + 1, y0), min(r.bottom, y1)
+            if bx0 < bx1 and by0 < by1: boxes.append((bx0, bx1, by0, by1))
+
+        # split the corners into vertical slabs that are covered by the same boxes,
+        # and find the free intervals of each slab
+        xs = sorted(set([x0, x1] + [b[0] for b in boxes] + [b[1] for b in boxes]))
+        slabs, total = [], 0
+        for xa, xb in zip(xs[:-1], xs[1:]):
+            covered = sorted((b[2], b[3]) for b in boxes if b[0] <= xa and b[1] >= xb)
+            free, y = [], y0
+            for ya, yb in covered:
+                if ya > y: free.append((y, ya))
+                y = max(y, yb)
+            if y < y1: free.append((y, y1))
+            free_h = sum(yb - ya for ya, yb in free)
+            if free_h == 0: continue
+            slabs.append((xa, (xb - xa) * free_h, free, free_h))
+            total += (xb - xa) * free_h
+        if total == 0: return None
+
+        # pick one of the free corners uniformly
+        k = rng.randrange(total)
+        for xa, slab_total, free, free_h in slabs:
+            if k < slab_total: break
+            k -= slab_total
+        x, k = xa + k // free_h, k % free_h
+        for ya, yb in free:
+            if k < yb - ya: break
+            k -= yb - ya
+        return Rect(x, ya + k, w, h)
+
+def changed_rects(old, new):
+    """Return the regions to redraw when a drawn region moves from old to new.
+    Either region may be None if nothing was (or will be) drawn.
+    """
+    if old == new: return []
+    if old is None: return [new]
+    if new is None: return [old]
+    if old.colliderect(new): return [old.union(new)]
+    return [old, new]
+
+def merge_rects(rects):
+    """Merge overlapping regions so that no pixel is covered twice.
+    """
+    merged = []
+    for rect in rects:
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect = rect.union(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
 
 def scale_surface(surface, percent):
 
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+"""Benchmarks of the hot paths of the game, run headless under SDL's dummy
+video and audio drivers: rendering, animal placement, sampling of mole
+positions, trial recording, the score bar and the slide menu.
+
+Every benchmark reports operations per second (the best of a few repeats)
+and the memory allocated per operation. Results can be saved as a JSON
+baseline and compared with a later run, e.g. before and after a change:
+
+    python wam_bench.py --save before.json
+    python wam_bench.py --compare before.json
+"""
+
+from __future__ import print_function
+import os
+# the benchmarks must not open a window or an audio device
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from wam_demo import *
+import argparse, gc, json, platform, random, shutil, tempfile
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+import slidemenu.slidemenu
+
+BENCHMARKS = [] # (name, setup); setup() returns the operation to time
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+def run(op, min_time = .2, repeat = 3):
+    """Return the best operations per second of op over repeat runs of at
+    least min_time seconds each.
+    """
+    best = 0.
+    for r in xrange(repeat):
+        n, start = 0, monotonic()
+        while True:
+            op()
+            n += 1
+            elapsed = monotonic() - start
+            if elapsed >= min_time: break
+        best = max(best, n / elapsed)
+    return best
+
+def allocations(op, number = 200):
+    """Return the memory allocated by op, per call: the net and peak bytes
+    with tracemalloc, or else the net number of objects tracked by gc.
+    """
+    op() # warm up caches
+    if tracemalloc is not None:
+        tracemalloc.start()
+        for i in xrange(number): op()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {'bytes_per_op': float(current) / number, 'peak_bytes': peak}
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        for i in xrange(number): op()
+        after = len(gc.get_objects())
+    finally:
+        if enabled: gc.enable()
+    return {'objects_per_op': float(after - before) / number}
+
+class Session(object):
+    """A game of the demo design whose data files go to a temporary directory.
+    """
+
+    def __init__(self, **kwargs):
+        self.data_dir = tempfile.mkdtemp(prefix = 'wam_bench')
+        random.seed(0)
+        self.game = Game(subj_id = 'bench',
+                         dist_seq = DIST_SEQ, bundle_length_seq = BUNDLE_LENGTH_SEQ,
+                         all_mole_dists = ALL_MOLE_DISTS, all_animal_dists = ALL_ANIMAL_DISTS,
+                         exact_proportion = EXACT_PROPORTION, seed = 0,
+                         data_dir = self.data_dir, **kwargs)
+        self.world = self.game.world
+
+    def start_bundle(self, animal_dist = ALL_ANIMAL_DISTS[0]):
+        self.world.add_mole(ALL_MOLE_DISTS[0])
+        self.world.add_animals(animal_dist)
+        self.world.arrange_animals()
+
+    def close(self):
+        self.game.close()
+        shutil.rmtree(self.data_dir, ignore_errors = True)
+
+def rising_mole(world):
+    """Return an operation that moves the mole through a whole trial, one
+    frame per call.
+    """
+    mole, hole = world.mole, [0]
+    def step():
+        if mole.moveable():
+            hole[0] = (hole[0] + 1) % len(world.hole_positions)
+            mole.move_to_hole(hole[0])
+        mole.show(17)
+        mole.wait(17)
+        mole.hide(17)
+    return step
+
+def session_benchmark(setup):
+    """Build the operation of setup(session) on a fresh session, and close
+    the session once the benchmark is done.
+    """
+    def wrapped(sessions):
+        session = Session()
+        sessions.append(session)
+        return setup(session)
+    return wrapped
+
+@benchmark('render.full')
+@session_benchmark
+def bench_render_full(session):
+    session.start_bundle()
+    world, screen, step = session.world, session.game.screen, rising_mole(session.world)
+    def op():
+        step()
+        world.render(screen)
+    return op
+
+@benchmark('render.dirty')
+@session_benchmark
+def bench_render_dirty(session):
+    session.start_bundle()
+    world, screen, step = session.world, session.game.screen, rising_mole(session.world)
+    def op():
+        step()
+        world.mole.show_hammered_image(screen, world.render(screen, dirty = True))
+    return op
+
+def bench_placement(animal_dist):
+    @session_benchmark
+    def setup(session):
+        session.start_bundle(animal_dist)
+        return session.world.arrange_animals
+    return setup
+
+# sparse, the demo's density, and dense
+for animal_dist in ({'rabbit': 1, 'snail': 1, 'hippo': 1, 'dinosaur': 1},
+                    {'rabbit': 2, 'snail': 2, 'hippo': 2, 'dinosaur': 2},
+                    {'rabbit': 3, 'snail': 3, 'hippo': 2, 'dinosaur': 2}):
+    benchmark('arrange_animals.%d_animals' % sum(animal_dist.values()))(bench_placement(animal_dist))
+
+@benchmark('sample')
+def bench_sample(sessions):
+    a, p = range(4), ALL_MOLE_DISTS[0]
+    return lambda: sample(a, p)
+
+@benchmark('sampler.draw')
+def bench_sampler(sessions):
+    return Sampler(range(4), ALL_MOLE_DISTS[0], seed = 0).draw
+
+# a typical record, built from RECORD_FIELDS so that the two cannot drift apart
+RECORD = dict((field, 1.5 if COLUMN_TYPES.get(field) == 'd' else 1) for field in RECORD_FIELDS)
+RECORD.update(subject = 'bench', reaction_time = 500, score = 10)
+
+@benchmark('record')
+@session_benchmark
+def bench_record(session):
+    """The cost of Game.record to the game loop: storing and queueing a record.
+    """
+    game = session.game
+    return lambda: game.record(**RECORD)
+
+def bench_record_write(compress):
+    """The cost to the writer thread of writing out a record.
+    """
+    def setup(sessions):
+        session = Session(compress = compress)
+        sessions.append(session)
+        writer = session.game.writer
+        record = tuple([RECORD[field] for field in RECORD_FIELDS])
+        return lambda: writer._write(record)
+    return setup
+
+benchmark('record.write.csv')(bench_record_write(False))
+benchmark('record.write.csv.gz')(bench_record_write(True))
+
+@benchmark('scorebar.render')
+@session_benchmark
+def bench_scorebar(session):
+    world, screen = session.world, session.game.screen
+    scorebar = [e for e in world.entities if isinstance(e, ScoreBar)][0]
+    def op():
+        world.score += 7
+        scorebar.render(screen)
+    return op
+
+class _MenuTime(object):
+    """Stands in for pygame.time in slidemenu: instead of pausing to flash the
+    highlighted item, post an escape so that menu() returns at once.
+    """
+    Clock = pygame.time.Clock
+    set_timer = staticmethod(pygame.time.set_timer)
+    def wait(self, milliseconds):
+        pygame.event.post(pygame.event.Event(KEYDOWN, key = K_ESCAPE, mod = 0))
+
+@benchmark('slidemenu.menu')
+def bench_menu(sessions):
+    items = ['Warm up', 'Start Game', 'Toggle fullscreen::Switch between a window and the full screen', 'Exit']
+    def op():
+        real_time = slidemenu.slidemenu.time
+        slidemenu.slidemenu.time = _MenuTime()
+        try:
+            menu(items, color1 = (255,80,40), light = 9, tooltiptime = 1000, speed = 0, hotspot = (38,15))
+        finally:
+            slidemenu.slidemenu.time = real_time
+    return op
+
+def run_all(names = None, min_time = .2, repeat = 3):
+    """Run the benchmarks (all, or those whose names start with one of names)
+    and return their results by name.
+    """
+    pygame.init()
+    pygame.display.set_mode(Game.SCREEN_SIZE, 0, 32)
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and not any(name.startswith(n) for n in names): continue
+        sessions = []
+        try:
+            op = setup(sessions)
+            result = {'ops_per_sec': run(op, min_time, repeat)}
+            result.update(allocations(op))
+        finally:
+            for session in sessions: session.close()
+        results[name] = result
+        print_result(name, result)
+    return results
+
+def print_result(name, result, baseline = None):
+    allocated = ('%.0f B/op' % result['bytes_per_op'] if 'bytes_per_op' in result
+                 else '%.1f objects/op' % result['objects_per_op'])
+    line = '%-28s %12.1f ops/s %18s' % (name, result['ops_per_sec'], allocated)
+    if baseline is not None:
+        line += '   %+6.1f%%' % (100. * (result['ops_per_sec'] / baseline['ops_per_sec'] - 1))
+    print(line, file=sys.stderr)
+
+def compare(results, baselines, threshold = .2):
+    """Print the change of every benchmark against a baseline and return the
+    names of those more than threshold slower.
+    """
+    slower = []
+    print('compared with the baseline:', file=sys.stderr)
+    for name in sorted(results):
+        if name not in baselines: continue
+        print_result(name, results[name], baselines[name])
+        if results[name]['ops_per_sec'] < (1 - threshold) * baselines[name]['ops_per_sec']:
+            slower.append(name)
+    return slower
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the Whack-The-Mole game headless.')
+    parser.add_argument('names', nargs='*', help='Only run the benchmarks whose names start with these')
+    parser.add_argument('--min-time', default = .2, type=float, help='Seconds each repeat of a benchmark runs at least')
+    parser.add_argument('--repeat', default = 3, type=int, help='The number of repeats; the best one is reported')
+    parser.add_argument('--save', default = None, type=str, help='Save the results as a JSON baseline')
+    parser.add_argument('--compare', default = None, type=str, help='Compare the results with a JSON baseline')
+    parser.add_argument('--threshold', default = .2, type=float, help='Relative slowdown against the baseline that counts as a regression')
+    args = parser.parse_args()
+
+    results = run_all(args.names, args.min_time, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'pygame': pygame.version.ver,
+                       'results': results}, f, indent = 1, sort_keys = True)
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f)['results'], args.threshold)
+        if slower:
+            print('slower than the baseline:', ', '.join(slower), file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+from __future__ import print_function
+import sys, os, atexit, threading, json, mmap, struct, argparse
+from array import array
+from collections import deque
+from time import time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the fields of a trial record, in the order they are written out. frames,
+# the frame intervals and slow_frames count the frames of the game loop,
+# including those that were not drawn because nothing on the screen changed;
+# presented_frames counts the frames that were drawn and presented
+RECORD_FIELDS = ('subject', 'block', 'bundle',
+                 'session_trial', 'block_trial', 'bundle_trial',
+                 'reaction_time', 'onset_time', 'click_time', 'score', 'which_hole',
+                 'hole0_design_prob', 'hole1_design_prob', 'hole2_design_prob', 'hole3_design_prob',
+                 'bundle_length',
+                 'rabbit_count', 'snail_count', 'dinosaur_count', 'hippo_count',
+                 'mole_dist_freq', 'mole_dist_freq_block',
+                 'animal_dist_freq', 'animal_dist_freq_block',
+                 'mole_dist_idx', 'animal_dist_idx',
+                 'frames', 'max_frame_interval', 'mean_frame_interval', 'slow_frames', 'reveal_time',
+                 'sound_time', 'presented_frames')
+
+# the array typecode of each field in the columnar format; the subject is
+# stored once in the file header instead of in a column
+COLUMN_TYPES = {'block': 'h', 'bundle': 'h',
+                'session_trial': 'i', 'block_trial': 'i', 'bundle_trial': 'i',
+                'reaction_time': 'i', 'onset_time': 'd', 'click_time': 'd',
+                'score': 'i', 'which_hole': 'b',
+                'hole0_design_prob': 'd', 'hole1_design_prob': 'd',
+                'hole2_design_prob': 'd', 'hole3_design_prob': 'd',
+                'bundle_length': 'i',
+                'rabbit_count': 'h', 'snail_count': 'h', 'dinosaur_count': 'h', 'hippo_count': 'h',
+                'mole_dist_freq': 'i', 'mole_dist_freq_block': 'i',
+                'animal_dist_freq': 'i', 'animal_dist_freq_block': 'i',
+                'mole_dist_idx': 'h', 'animal_dist_idx': 'h',
+                'frames': 'i', 'max_frame_interval': 'i', 'mean_frame_interval': 'd',
+                'slow_frames': 'i', 'reveal_time': 'i', 'sound_time': 'd',
+                'presented_frames': 'i'}
+
+# values that cannot be stored in a typed column are mapped to -1
+MISSING = {'block': 'WARM_UP', 'bundle': None, 'reaction_time': None,
+           'onset_time': None, 'click_time': None, 'reveal_time': None, 'sound_time': None}
+
+class RecordWriter(threading.Thread):
+    """Write trial records to a file on a background thread, so that formatting,
+    compression and disk stalls never hold up the game loop.
+
+    Records are tuples in the order of fields, appended to a bounded queue.
+    The writer sleeps until it is woken by flush(), close() or a full queue,
+    or until written records are due: the file is flushed whenever flush() is
+    called and, if flush_interval is set, at least every flush_interval
+    seconds (0 flushes after every record). With fsync the data is also
+    forced to disk on every flush.
+    """
+
+    PUT_TIMEOUT = 1. # seconds a full queue is waited on before checking the writer again
+    _FLUSH, _CLOSE = object(), object()
+
+    def __init__(self, dest, fields = RECORD_FIELDS, mumble = False,
+                 maxsize = 4096, flush_interval = None, fsync = False, columnar = None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.dest = dest
+        self.fields = fields
+        self.mumble = mumble
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.columnar = columnar # a ColumnarWriter also fed with every record, if any
+        self.queue = deque()
+        self.wake = threading.Event() # set to wake the writer
+        self.drained = threading.Event() # set by the writer whenever it emptied the queue
+        self.idle = False # whether the writer sleeps until the next record comes
+        self.header_written = False
+        self.closed = False
+        self.start()
+        atexit.register(self.close)
+
+    def put(self, record):
+        """Queue a record for writing. Only blocks if the queue is full, and
+        then raises a RuntimeError if the writer has stopped.
+        """
+        if len(self.queue) >= self.maxsize: self._wait_for_room()
+        self.queue.append(record)
+        if self.idle: self.wake.set()
+
+    def _wait_for_room(self):
+        while len(self.queue) >= self.maxsize:
+            if not self.is_alive(): raise RuntimeError('the record writer has stopped')
+            self.drained.clear()
+            self.wake.set()
+            self.drained.wait(RecordWriter.PUT_TIMEOUT)
+
+    def flush(self):
+        """Ask the writer to flush everything queued so far.
+        """
+        self.queue.append(RecordWriter._FLUSH)
+        self.wake.set()
+
+    def close(self):
+        """Write out all queued records, close the file and stop the writer.
+        """
+        if self.closed: return
+        self.closed = True
+        if self.is_alive():
+            self.queue.append(RecordWriter._CLOSE)
+            self.wake.set()
+            self.join()
+
+    def run(self):
+        queue = self.queue
+        last_flush, pending = time(), False
+        while True:
+            if not queue:
+                if pending and self.flush_interval is not None:
+                    # sleep until the written records are due to be flushed
+                    timeout = last_flush + self.flush_interval - time()
+                    if timeout > 0: self.wake.wait(timeout)
+                else:
+                    # with a flush interval the next record wakes the writer;
+                    # idle is set before the queue is checked again, so that
+                    # a record put in between is never missed
+                    self.idle = self.flush_interval is not None
+                    if not queue: self.wake.wait()
+                    self.idle = False
+                self.wake.clear()
+
+            while queue:
+                record = queue.popleft()
+                if record is RecordWriter._CLOSE:
+                    self._flush()
+                    try: self.dest.close()
+                    except: pass
+                    if self.columnar is not None: self.columnar.close()
+                    return
+                elif record is RecordWriter._FLUSH:
+                    self._flush()
+                    last_flush, pending = time(), False
+                else:
+                    self._write(record)
+                    pending = True
+            self.drained.set()
+
+            if pending and self.flush_interval is not None and time() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush, pending = time(), False
+
+    def _write(self, record):
+        header = [_.replace('_', '.') for _ in self.fields]
+        if not self.header_written:
+            print(*header, file=self.dest, sep=',')
+            self.header_written = True
+        if self.mumble:
+            print(*header, file=sys.stderr, sep=',')
+
+        print(*record, file=self.dest, sep=',')
+        if self.mumble:
+            print(*record, file=sys.stderr, sep=',')
+        if self.columnar is not None:
+            self.columnar.append(record)
+
+    def _flush(self):
+        if self.columnar is not None:
+            self.columnar.write_chunk(self.fsync)
+        try:
+            self.dest.flush()
+            if self.fsync: os.fsync(self.dest.fileno())
+        except: pass
+
+class TrialStore(object):
+    """In-memory store of the trials of a session, preallocated as one typed
+    array per field of COLUMN_TYPES. Appending a record only writes into the
+    arrays, and per-block totals are kept so that block summaries take O(1).
+    Queries are vectorized with NumPy when it is installed.
+    """
+
+    def __init__(self, size, fields = RECORD_FIELDS):
+        self.fields = fields
+        self.columns = [(i, f) for i, f in enumerate(fields) if f in COLUMN_TYPES]
+        self.arrays = dict((f, array(COLUMN_TYPES[f], [0]) * size) for i, f in self.columns)
+        self.size = size
+        self.n = 0
+        self.block_totals = {} # block -> [trials, hits, sum of reaction times]
+        self.score = 0
+
+    def reserve(self, size):
+        """Make room for at least size more trials.
+        """
+        missing = self.n + size - self.size
+        if missing <= 0: return
+        for i, field in self.columns:
+            self.arrays[field].extend(array(COLUMN_TYPES[field], [0]) * missing)
+        self.size += missing
+
+    def append(self, record):
+        """Store a record given in the order of fields.
+        """
+        n = self.n
+        # trials beyond the reserved size are not expected, but must not be lost
+        if n == self.size: self.reserve(max(self.size, 1))
+        for i, field in self.columns:
+            value = record[i]
+            if field in MISSING and value == MISSING[field]: value = -1
+            self.arrays[field][n] = value
+        self.n = n + 1
+
+        block, reaction_time = self.arrays['block'][n], self.arrays['reaction_time'][n]
+        try: totals = self.block_totals[block]
+        except KeyError: totals = self.block_totals[block] = [0, 0, 0]
+        totals[0] += 1
+        if reaction_time != -1:
+            totals[1] += 1
+            totals[2] += reaction_time
+        self.score = self.arrays['score'][n]
+
+    def get_block_summary(self, block):
+        """Return the number of trials, the hit rate and the mean reaction time
+        of a block so far (None if there were no trials or no hits).
+        """
+        if block == MISSING['block']: block = -1
+        trials, hits, rt_sum = self.block_totals.get(block, (0, 0, 0))
+        hit_rate = float(hits) / trials if trials else None
+        mean_rt = float(rt_sum) / hits if hits else None
+        return trials, hit_rate, mean_rt
+
+    def get_column(self, field):
+        """Return the values of a field for all stored trials (a NumPy view
+        of the store if NumPy is installed).
+        """
+        if numpy is not None:
+            return numpy.frombuffer(self.arrays[field], COLUMN_TYPES[field], self.n)
+        return self.arrays[field][:self.n]
+
+    def select(self, field, **where):
+        """Return the values of a field in the trials whose fields equal the given
+        values, e.g. select('which_hole', block = 2, bundle = 0). Missing values
+        (the WARM_UP block, no bundle, no reaction time) are stored as -1.
+        """
+        where = [(f, -1 if f in MISSING and v == MISSING[f] else v) for f, v in where.items()]
+        if numpy is not None:
+            mask = numpy.ones(self.n, bool)
+            for f, v in where:
+                mask &= self.get_column(f) == v
+            return self.get_column(field)[mask]
+        rows = xrange(self.n)
+        for f, v in where:
+            column = self.arrays[f]
+            rows = [i for i in rows if column[i] == v]
+        column = self.arrays[field]
+        return [column[i] for i in rows]
+
+    def get_rts(self, **where):
+        """Return the reaction times of the hits among the selected trials, e.g.
+        get_rts(block = 1), get_rts(which_hole = 0) or get_rts(mole_dist_idx = 2).
+        """
+        rts = self.select('reaction_time', **where)
+        if numpy is not None: return rts[rts != -1]
+        return [rt for rt in rts if rt != -1]
+
+    def get_hit_rate(self, **where):
+        """Return the proportion of the selected trials in which the mole was hit.
+        """
+        trials = len(self.select('reaction_time', **where))
+        if trials == 0: return None
+        return float(len(self.get_rts(**where))) / trials
+
+    def get_running_score(self):
+        """Return the score after each stored trial.
+        """
+        return self.get_column('score')
+
+class ColumnarWriter(object):
+    """Write trial records to a fixed-schema columnar binary file.
+
+    The file starts with MAGIC, the length of a JSON header (the fields and
+    their typecodes, the byte order and the subject) and the header itself.
+    Records are buffered and written in chunks, usually one per bundle: the
+    number of rows, then each column as a contiguous typed array. Every part
+    is padded to 8 bytes so that columns can be used in place from a memory
+    map (see read_columns).
+    """
+
+    MAGIC = b'WTMCOL01'
+
+    def __init__(self, path, subject, fields = RECORD_FIELDS, types = COLUMN_TYPES):
+        self.dest = open(path, 'wb')
+        self.fields = fields
+        self.columns = [(i, f) for i, f in enumerate(fields) if f in types]
+        self.buffers = [array(types[f]) for i, f in self.columns]
+        header = json.dumps({'fields': [[f, types[f]] for i, f in self.columns],
+                             'byteorder': sys.byteorder, 'subject': subject}).encode('utf-8')
+        self.dest.write(ColumnarWriter.MAGIC + struct.pack('<I', len(header)) + header + _padding(len(header) + 12))
+
+    def append(self, record):
+        for (i, field), buf in zip(self.columns, self.buffers):
+            value = record[i]
+            if field in MISSING and value == MISSING[field]: value = -1
+            buf.append(value)
+
+    def write_chunk(self, fsync = False):
+        """Write the buffered records as one chunk.
+        """
+        self.write_columns(self.buffers, fsync)
+        for buf in self.buffers:
+            del buf[:]
+
+    def write_columns(self, columns, fsync = False):
+        """Write one chunk from arrays given in the order of the columns.
+        """
+        rows = len(columns[0])
+        if rows == 0: return
+        self.dest.write(struct.pack('<Q', rows))
+        for column in columns:
+            data = column.tostring()
+            self.dest.write(data + _padding(len(data)))
+        self.dest.flush()
+        if fsync: os.fsync(self.dest.fileno())
+
+    def close(self):
+        self.write_chunk()
+        self.dest.close()
+
+# the columns of a trajectory file, with their array typecodes
+TRAJECTORY_FIELDS = ('session_trial', 'time', 'x', 'y')
+TRAJECTORY_TYPES = {'session_trial': 'i', 'time': 'd', 'x': 'h', 'y': 'h'}
+
+class TrajectoryRecorder(object):
+    """Record every mouse position with its time and the current trial, for
+    studying movements. Samples go into a preallocated ring buffer of typed
+    arrays, so that adding one allocates nothing, and flush() writes the
+    samples since the last flush as one chunk of a columnar file (see
+    ColumnarWriter). If the buffer fills up before a flush, it is flushed
+    right away.
+    """
+
+    def __init__(self, path, subject, capacity = 1 << 17):
+        self.writer = ColumnarWriter(path, subject, TRAJECTORY_FIELDS, TRAJECTORY_TYPES)
+        self.buffers = [array(TRAJECTORY_TYPES[f], [0]) * capacity for f in TRAJECTORY_FIELDS]
+        self.trials, self.times, self.xs, self.ys = self.buffers
+        self.capacity = capacity
+        self.head = 0 # the number of samples added
+        self.tail = 0 # the number of samples written out
+        self.trial = -1 # the session trial that new samples belong to
+        atexit.register(self.close)
+
+    def add(self, t, x, y):
+        head = self.head
+        if head - self.tail == self.capacity: self.flush()
+        i = head % self.capacity
+        self.trials[i] = self.trial
+        self.times[i] = t
+        self.xs[i] = x
+        self.ys[i] = y
+        self.head = head + 1
+
+    def flush(self, fsync = False):
+        if self.head == self.tail or self.writer.dest.closed: return
+        i, j = self.tail % self.capacity, self.head % self.capacity
+        if i < j: columns = [buf[i:j] for buf in self.buffers]
+        else: columns = [buf[i:] + buf[:j] for buf in self.buffers]
+        self.writer.write_columns(columns, fsync)
+        self.tail = self.head
+
+    def close(self):
+        if self.writer.dest.closed: return
+        self.flush()
+        self.writer.close()
+
+def _padding(n):
+    return b'\0' * (-n % 8)
+
+def read_columns(path):
+    """Read a columnar file through a memory map. Return the header and a dict
+    of the columns. With NumPy each column is a list of arrays (one per chunk)
+    that refer to the memory map without copying; otherwise each column is a
+    list of array.array.
+    """
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    if mm[0:8] != ColumnarWriter.MAGIC:
+        raise ValueError('%s is not a columnar trial file' % path)
+    header_len = struct.unpack('<I', mm[8:12])[0]
+    header = json.loads(mm[12:12 + header_len].decode('utf-8'))
+    swap = header['byteorder'] != sys.byteorder
+    columns = dict((field, []) for field, typecode in header['fields'])
+
+    offset = 12 + header_len + len(_padding(12 + header_len))
+    while offset < len(mm):
+        rows = struct.unpack('<Q', mm[offset:offset + 8])[0]
+        offset += 8
+        for field, typecode in header['fields']:
+            size = rows * array(typecode).itemsize
+            if numpy is not None:
+                dtype = numpy.dtype(typecode).newbyteorder('S' if swap else '=')
+                columns[field].append(numpy.frombuffer(mm, dtype, rows, offset))
+            else:
+                column = array(typecode)
+                column.fromstring(mm[offset:offset + size])
+                if swap: column.byteswap()
+                columns[field].append(column)
+            offset += size + len(_padding(size))
+    return header, columns
+
+def columnar_to_csv(path, dest = sys.stdout):
+    """Convert a columnar file to the CSV layout written by RecordWriter, or
+    for other columnar files (e.g. trajectories), to a CSV of the subject and
+    the columns.
+    """
+    header, columns = read_columns(path)
+    fields = [field for field, typecode in header['fields']]
+    out_fields = RECORD_FIELDS if all(f in RECORD_FIELDS for f in fields) else ['subject'] + fields
+    print(*[_.replace('_', '.') for _ in out_fields], file=dest, sep=',')
+    chunks = zip(*[columns[field] for field in fields])
+    for chunk in chunks:
+        for row in zip(*[c.tolist() for c in chunk]):
+            values = dict(zip(fields, row))
+            values['subject'] = header['subject']
+            for field, missing in MISSING.items():
+                if values.get(field) == -1: values[field] = missing
+            print(*[values[field] for field in out_fields], file=dest, sep=',')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert a columnar trial or trajectory file to CSV.')
+    parser.add_argument('src', type=str, help='The columnar file written by the game')
+    parser.add_argument('dest', nargs='?', default=None, type=str, help='The CSV file to write; standard output by default')
+    args = parser.parse_args()
+
+    if args.dest is None:
+        columnar_to_csv(args.src)
+    else:
+        with open(args.dest, 'w') as dest:
+            columnar_to_csv(args.src, dest)
@@ -4,14 +4,17 @@
 from __future__ import print_function
 from wam import *
 from slidemenu.slidemenu import *
-import sys, argparse, gzip, random
+from wam_data import *
+import sys, os, argparse, gzip
 from datetime import datetime
-from time import time
 
 class Game(object):
     
     SCREEN_SIZE = (1000, 734)
-    WARM_UP_TRIAL_NO = 20
+    FRAMERATE = 60
+    SLOW_FRAME = 1.5 * 1000. / FRAMERATE # frame intervals longer than this (in ms) count as slow
+    READY_MESSAGE, COUNTDOWN = "Get Ready!", 3
+    COUNTDOWN_FONT = ("data/fof.ttf", 80)
 
     def __init__(self,
                  subj_id,
@@ -21,12 +24,20 @@ class Game(object):
                  all_animal_dists, # the probability distribution of background animals; N = # of unique animal distributions
                  exact_proportion,
                  hole_positions = [(320,450), (300, 600), (700, 500), (680, 650)],
-                 mumble = False, compress = False):
+                 mumble = False, compress = False, dirty_rects = False,
+                 seed = None, # the seed of the trial schedule; drawn at random if None
+                 flush_interval = None, fsync = False, # how the data file is flushed besides at the end of each bundle
+                 columnar = False, # also write the data in the columnar binary format
+                 trajectory = False, # also record every mouse position in a side file
+                 profile = False, # time the phases of every frame and write their histograms next to the data
+                 data_dir = '.', # where the data files are written
+                 asset_pack = 'assets.pack', # decoded images, text and sounds built by wam_pack.py, if present
+                 headless = False, # run without drawing or sound, e.g. for simulations
+                 clock = None): # the clock of the game; a VirtualClock by default when headless
         """Initialize a game with a given world.
         """
         self.subj_id = subj_id
-        assert len(dist_seq) == len(bundle_length_seq)
-        assert len(all_mole_dists) == len(all_animal_dists)
+        self.design = Design(dist_seq, bundle_length_seq, all_mole_dists, all_animal_dists)
         self.dist_seq, self.bundle_length_seq = dist_seq, bundle_length_seq
         self.all_mole_dists, self.all_animal_dists = all_mole_dists, all_animal_dists
         self.exact_proportion = exact_proportion
@@ -37,18 +48,60 @@ class Game(object):
         self.animal_dist_history = {}
 
         # set up output file
+        basename = os.path.join(data_dir, '_'.join([subj_id, datetime.today().strftime('%Y-%m-%d-%H-%M')]))
         if compress:
-            self.dest = gzip.open('_'.join([subj_id, datetime.today().strftime('%Y-%m-%d-%H-%M')]) + '.csv.gz', 'w')
+            self.dest = gzip.open(basename + '.csv.gz', 'w')
         else:
-            self.dest = open('_'.join([subj_id, datetime.today().strftime('%Y-%m-%d-%H-%M')]) + '.csv', 'w')
+            self.dest = open(basename + '.csv', 'w')
         self.mumble = mumble
+        # records are written out by a background thread
+        self.writer = RecordWriter(self.dest, RECORD_FIELDS, mumble = mumble,
+                                   flush_interval = flush_interval, fsync = fsync,
+                                   columnar = ColumnarWriter(basename + '.wtmc', subj_id) if columnar else None)
+
+        # record mouse trajectories in a columnar side file
+        self.trajectory = TrajectoryRecorder(basename + '.trajectory.wtmc', subj_id) if trajectory else None
+
+        # time the phases of the game loop
+        if profile:
+            self.profiler = FrameProfiler(Game.FRAMERATE)
+            self.profile_dest = open(basename + '.profile.csv', 'w')
+            print('block', 'phase', 'bin.ms', 'count', file=self.profile_dest, sep=',')
+        else:
+            self.profiler = NullProfiler()
+            self.profile_dest = None
+
+        # compile the mole positions of all trials and save them next to the data
+        self.schedule = Schedule(self.design, exact_proportion, seed)
+        self.schedule_path = basename + '.schedule.csv'
+        self.schedule.save(self.schedule_path)
+
+        # keep every trial of the session in memory for quick summaries
+        self.store = TrialStore(len(self.schedule.holes))
             
         # set up screen 
-        self.screen = pygame.display.set_mode(Game.SCREEN_SIZE, 0, 32)
         self.fullscreen = False
+        self.headless = headless
+        if headless:
+            # no window is opened, images become size-only stubs and nothing
+            # is drawn or played
+            assets.headless = True
+            self.screen = StubSurface(Game.SCREEN_SIZE)
+            if clock is None: clock = VirtualClock()
+        else:
+            self.screen = pygame.display.set_mode(Game.SCREEN_SIZE, 0, 32)
+        # only push the changed regions of the world to the display
+        self.dirty_rects = dirty_rects
+
+        # take decoded assets from the asset pack, unless it is missing or stale
+        if not headless and asset_pack: use_asset_pack(asset_pack)
+
+        # decode all images and sound effects ahead of time, in parallel
+        if headless: sounds.preload()
+        else: load_assets(image_manifest(), progress = self.show_loading)
 
         # set up the world
-        world = World()
+        world = World(clock)
         world.add_tree()
         world.add_scorebar()
         
@@ -63,33 +116,38 @@ class Game(object):
             hole_cover.rect = Rect(x, y - h, w, h)
             world.add_entity(hole_cover)
 
+        # build the animals of the design, rejecting it if they do not fit
+        for animal_dist in all_animal_dists:
+            world.reserve_animals(animal_dist)
+
         self.world = world
 
     def get_bundle_info(self, block, bundle_idx=None):
         """Given a bundle index, retrieve its length, the associated distribution of mole positions,
         and its distribution of background animals.
         """
-        if block == 'WARM_UP':
-            bundle_length = Game.WARM_UP_TRIAL_NO
-            mole_dist = [0.25] * 4
-            animal_dist = {'rabbit': 2, 'snail': 2, 'hippo': 2, 'dinosaur': 2}
-            mole_dist_idx, animal_dist_idx = 0, 0
-        else:
-            assert type(block) is int and type(bundle_idx) is int
-            mole_dist_idx, animal_dist_idx = self.dist_seq[block][bundle_idx]
-            bundle_length = self.bundle_length_seq[block][bundle_idx]
-            mole_dist = self.all_mole_dists[mole_dist_idx]
-            animal_dist = self.all_animal_dists[animal_dist_idx]
-            
-        return bundle_length, mole_dist, animal_dist, mole_dist_idx, animal_dist_idx
+        return self.design.get_bundle_info(block, bundle_idx)
         
+    def show_loading(self, done, total):
+        """Draw a progress bar of the assets loaded so far.
+        """
+        self.screen.fill((245,245,245))
+        outline = Rect(300, 352, 400, 30)
+        pygame.draw.rect(self.screen, (0,0,0), outline, 2)
+        if total:
+            bar = outline.inflate(-8, -8)
+            bar.width = bar.width * done // total
+            pygame.draw.rect(self.screen, (0,0,0), bar)
+        pygame.display.update()
+        pygame.event.pump()
+
     def start(self):
         """Start the game.
         """
         while True:
             self.screen.fill((0,0,0))
             pygame.display.update()
-            pygame.mixer.music.stop()
+            self.world.music.stop()
             resp = menu(['Warm up', 'Start Game', 'Toggle fullscreen', 'Exit'],
                         color1     = (255,80,40),
                         light      = 9,
@@ -111,16 +169,24 @@ class Game(object):
             elif resp[0] == 'Warm up':
                 self.whack_session(block = 'WARM_UP')
             elif resp[0] == 'Exit':
+                self.close()
                 return
 
             pygame.display.update()
         
+    def close(self):
+        """Write out and close the data files, and leave headless mode.
+        """
+        self.writer.close()
+        if self.trajectory is not None: self.trajectory.close()
+        if self.profile_dest is not None: self.profile_dest.close()
+        # games built later in the process draw and play sounds again
+        if self.headless: assets.headless = False
+
     def rearrange_animals(self):
         """Randomly rearrange the positions of animals on the screen.
         """    
-        for entity in self.world.entities:
-            if entity.type == 'animal':
-                entity.auto_location()
+        self.world.arrange_animals()
                 
     def whack_session(self, block):
         """Start the game. 
@@ -131,39 +197,57 @@ class Game(object):
         animal_dist_history_block = {}
         
         # session prompt
-        message, countdown = "Get Ready!", 3
+        message, countdown = Game.READY_MESSAGE, Game.COUNTDOWN
         self.screen.fill((255,255,255))
-        font = pygame.font.Font("data/fof.ttf", 80);
-        text_surface = font.render(message, True, (0, 0, 0))
+        text_surface = texts.render(Game.COUNTDOWN_FONT[0], Game.COUNTDOWN_FONT[1], message, (0, 0, 0))
 
         # set up clock
-        clock = pygame.time.Clock()
+        clock = self.world.clock
+
+        # The difference between a warm up session and a regular session
+        # is taken care of by the start() method
+        bundle_range = self.design.get_bundle_range(block)
+
+        # prepare the animals of every bundle and room for every trial of the
+        # block ahead of time, so that no loading or allocation happens in the trials
+        bundle_infos = [self.get_bundle_info(block, bundle_idx) for bundle_idx in bundle_range]
+        for bundle_info in bundle_infos:
+            self.world.reserve_animals(bundle_info[2])
+        self.store.reserve(sum(bundle_info[0] for bundle_info in bundle_infos))
+
+        # every play of a block has its own mole positions; save new ones
+        num_plays = self.schedule.num_plays
+        play = self.schedule.start(block)
+        if self.schedule.num_plays > num_plays: self.schedule.save(self.schedule_path)
         
-        for i in xrange(3):
+        for i in xrange(countdown):
             self.screen.fill((245,245,245))
             self.screen.blit(text_surface, (350,280))
-            countdown_surface = font.render(str(countdown-i), True, (0,0,0))
+            countdown_surface = texts.render(Game.COUNTDOWN_FONT[0], Game.COUNTDOWN_FONT[1], str(countdown-i), (0,0,0))
             self.screen.blit(countdown_surface, (500,430))
-            pygame.mixer.Sound('sounds/ticking.wav').play()
-            pygame.display.update()
+            sounds.play('sounds/ticking.wav', clock)
+            if not self.headless: pygame.display.update()
             timer = 0
             while timer < 1000:
                 pygame.event.pump()
                 timer += clock.tick(60)
 
         # begin session
-        pygame.mouse.set_visible(True)
-        pygame.mixer.music.play()
-
-        # The difference between a warm up session and a regular session
-        # is taken care of by the start() method
-        if block == 'WARM_UP':
-            bundle_range = [None]
-        else: bundle_range = range(len(self.dist_seq[block]))
+        if not self.headless: pygame.mouse.set_visible(True)
+        self.world.music.play()
+        self.world.invalidate()
+        if self.trajectory is None:
+            input_queue = InputQueue(clock, {MOUSEBUTTONDOWN: self.handle_click})
+        else:
+            input_queue = InputQueue(clock, {MOUSEBUTTONDOWN: self.handle_click, MOUSEMOTION: self.handle_motion},
+                                     InputQueue.TYPES + (MOUSEMOTION,))
+        input_queue.start()
+        profiler = self.profiler
+        profiler.reset()
         
         # start the trials
-        for bundle_idx in bundle_range:
-            bundle_length, mole_dist, animal_dist, mole_dist_idx, animal_dist_idx = self.get_bundle_info(block, bundle_idx)
+        for bundle_idx, bundle_info in zip(bundle_range, bundle_infos):
+            bundle_length, mole_dist, animal_dist, mole_dist_idx, animal_dist_idx = bundle_info
             # add statistics
             try: self.dist_history[mole_dist_idx] += 1
             except KeyError: self.dist_history[mole_dist_idx] = 0
@@ -178,60 +262,79 @@ class Game(object):
             self.world.add_mole(mole_dist)
             self.world.add_animals(animal_dist)
 
-            # generate the exact proportion list
-            location_list = []
-            for loc_idx in xrange(4):
-                location_list.extend([loc_idx] * int(bundle_length * mole_dist[loc_idx]))
-            random.shuffle(location_list)
+            # the mole positions of this bundle in the precompiled schedule
+            bundle_start = self.schedule.bundle_bounds[(play, block, bundle_idx)][0]
             
             # reset clock
             clock.tick()
+            profiler.restart()
             # loop over all bundle trials
             for bundle_trial in range(bundle_length):
+                if self.trajectory is not None: self.trajectory.trial = self.session_trial
+                # frame statistics of the trial
+                frames, max_interval, sum_interval, slow_frames, presented_frames = 0, 0, 0, 0, 0
                 while True:
-                    for event in pygame.event.get():
+                    profiler.start()
+                    for t, event in input_queue.get():
                         if event.type == KEYDOWN:
                             if event.key == K_ESCAPE:
-                                try: self.dest.flush()
-                                except: pass
+                                input_queue.stop()
+                                self.end_profile(block)
+                                self.flush()
                                 return
                             if event.key == K_s:
-                                if pygame.mixer.music.get_busy():
-                                    pygame.mixer.music.fadeout(2000)
+                                if self.world.music.get_busy():
+                                    self.world.music.fadeout(2000)
                                 else:
-                                    pygame.mixer.music.play()
-                        if event.type == MOUSEBUTTONDOWN:
-                            mouse_x, mouse_y = pygame.mouse.get_pos()
-                            self.world.mole.get_whacked(mouse_x, mouse_y)
+                                    self.world.music.play()
+                    profiler.mark('events')
 
-                
                     if self.world.mole.moveable():
-                        self.rearrange_animals()
-                        if self.exact_proportion:
-                            self.world.mole.move_to_hole(location_list[bundle_trial])
-                        else:
-                            self.world.mole.move_weighted(verbose = False)
-
-                    time_passed = clock.tick(60)
+                        # the animals are only scenery, never seen when headless
+                        if not self.headless: self.rearrange_animals()
+                        profiler.mark('rearrange')
+                        self.world.mole.move_to_hole(self.schedule.holes[bundle_start + bundle_trial])
+                        profiler.mark('move')
+
+                    # clicks are read and handled while waiting for the next frame
+                    time_passed = clock.tick(Game.FRAMERATE, input_queue.poll)
+                    profiler.mark('tick')
+                    profiler.frame()
+                    frames += 1
+                    sum_interval += time_passed
+                    if time_passed > max_interval: max_interval = time_passed
+                    if time_passed > Game.SLOW_FRAME: slow_frames += 1
                     self.world.mole.show(time_passed)
                     self.world.mole.wait(time_passed)
                     self.world.mole.hide(time_passed)
+                    profiler.mark('mole')
 
                     # detect the end of a trial
-                    if self.world.mole.visible is False and self.world.mole.status == 'STILL':
+                    if self.world.mole.visible is False and self.world.mole.status == Mole.STILL:
                         break
 
-                    self.world.render(self.screen)
-                    self.world.mole.show_hammered_image(self.screen)
-
-                    pygame.display.update()
+                    # nothing needs to be drawn when running headless, nor
+                    # when nothing on the screen changes, e.g. while the mole
+                    # waits at the top; input is still polled every frame
+                    if not self.headless and self.world.is_changed():
+                        dirty = self.world.render(self.screen, dirty = self.dirty_rects)
+                        profiler.mark('render')
+                        self.world.mole.show_hammered_image(self.screen, dirty)
+                        profiler.mark('bang')
+
+                        pygame.display.update(dirty)
+                        profiler.mark('update')
+                        presented_frames += 1
+                    # the mole's onset and reveal are the first display updates that show it
+                    self.world.mole.mark_displayed()
 
                 # make a record of this trial
                 self.record(
-                    dest = self.dest,
                     subject = self.subj_id, block = block, bundle = bundle_idx, 
                     session_trial = self.session_trial, block_trial = block_trial, bundle_trial = bundle_trial,
                     reaction_time = self.world.mole.get_alive_time(), score = self.world.score,
+                    onset_time = self.world.mole.onset_time,
+                    click_time = self.world.mole.end_time if self.world.mole.whacked else None,
                     which_hole = self.world.mole.current_hole_id,
                     hole0_design_prob = mole_dist[0], hole1_design_prob = mole_dist[1],
                     hole2_design_prob = mole_dist[2], hole3_design_prob = mole_dist[3],
@@ -239,40 +342,79 @@ class Game(object):
                     rabbit_count = animal_dist['rabbit'], snail_count = animal_dist['snail'],
                     dinosaur_count = animal_dist['dinosaur'], hippo_count = animal_dist['hippo'],
                     mole_dist_freq = self.dist_history[mole_dist_idx], mole_dist_freq_block = dist_history_block[mole_dist_idx],
-                    animal_dist_freq = self.animal_dist_history[animal_dist_idx], animal_dist_freq_block = animal_dist_history_block[animal_dist_idx]
+                    animal_dist_freq = self.animal_dist_history[animal_dist_idx], animal_dist_freq_block = animal_dist_history_block[animal_dist_idx],
+                    mole_dist_idx = mole_dist_idx, animal_dist_idx = animal_dist_idx,
+                    frames = frames, max_frame_interval = max_interval,
+                    mean_frame_interval = float(sum_interval) / frames, slow_frames = slow_frames,
+                    reveal_time = self.world.mole.get_reveal_time(),
+                    sound_time = self.world.mole.sound_time,
+                    presented_frames = presented_frames
                 )
                 block_trial += 1
                 self.session_trial += 1
 
             # flush out the result at the end of a bundle
-            try: self.dest.flush()
-            except: pass
+            self.flush()
 
-                
+        input_queue.stop()
+        self.end_profile(block)
+
+    def handle_click(self, event, t):
+        """Check right away whether a click at time t hits the mole.
+        """
+        mouse_x, mouse_y = event.pos
+        if self.trajectory is not None: self.trajectory.add(t, mouse_x, mouse_y)
+        if self.world.mole is None: return
+        self.world.mole.get_whacked(mouse_x, mouse_y, t)
+
+    def handle_motion(self, event, t):
+        mouse_x, mouse_y = event.pos
+        self.trajectory.add(t, mouse_x, mouse_y)
+
+    def end_profile(self, block):
+        """Write out the frame profile of a session, and print it with --mumble.
+        """
+        if self.profile_dest is None: return
+        self.profiler.write(self.profile_dest, block)
+        if self.mumble:
+            print('frame profile of block', block, file=sys.stderr)
+            self.profiler.report(sys.stderr)
+
+    def flush(self):
+        """Flush out the trial records and the trajectory.
+        """
+        self.writer.flush()
+        if self.trajectory is not None: self.trajectory.flush()
                 
     def pause_game(self, block):
         """Pause or end the game. If all blocks are presented the game will end.
         Otherwise, display a score and force a break.
         """
-        try: self.dest.flush()
-        except: pass
+        self.flush()
+        if self.mumble:
+            trials, hit_rate, mean_rt = self.store.get_block_summary(block)
+            print('block', block, 'trials', trials, 'hit rate', hit_rate, 'mean reaction time', mean_rt, file=sys.stderr)
+            delays = [1000. * (s - c) for s, c in zip(self.store.select('sound_time', block = block),
+                                                       self.store.select('click_time', block = block)) if s != -1]
+            if delays:
+                print('bang sound issued', sum(delays) / len(delays), 'ms after the click on average, plus',
+                      sounds.get_buffer_latency(), 'ms of mixer buffer', file=sys.stderr)
         if block < self.num_of_blocks:
             score_msg = "Good job! Your score is %s" % (self.world.score)
             break_msg = "Take a break. A new wave of moles are coming in 2 minutes!"
             continue_msg = "Touch anywhere to continue"
-            font = pygame.font.Font("data/intuitive.ttf", 30);
-            score_surface = font.render(score_msg, True, (0, 0, 0))
-            break_surface = font.render(break_msg, True, (0, 0, 0))        
-            continue_surface = font.render(continue_msg, True, (255, 0, 0))
+            score_surface = texts.render("data/intuitive.ttf", 30, score_msg, (0, 0, 0))
+            break_surface = texts.render("data/intuitive.ttf", 30, break_msg, (0, 0, 0))
+            continue_surface = texts.render("data/intuitive.ttf", 30, continue_msg, (255, 0, 0))
             self.screen.fill((245,245,245))
 
-            clock = pygame.time.Clock()
+            clock = self.world.clock
             clock.tick(10)
             timer = 0
             self.screen.blit(score_surface, (340,240))
             self.screen.blit(break_surface, (140,320))
 
-            pygame.mixer.music.stop()
+            self.world.music.stop()
             pygame.mouse.set_visible(True)
 
             pygame.display.update()
@@ -292,61 +434,76 @@ class Game(object):
 
         else: # if all blocks have been presented, end game
             message = "Game Over. You did an excellent job!"
-            font = pygame.font.Font("data/intuitive.ttf", 36);
-            text_surface = font.render(message, True, (255, 0, 0))
+            text_surface = texts.render("data/intuitive.ttf", 36, message, (255, 0, 0))
             self.screen.fill((245,245,245))
             self.screen.blit(text_surface, (200,280))
             pygame.display.update()
-            pygame.time.wait(1000 * 3)
+            self.world.clock.wait(1000 * 3)
             return
 
-    def record(self, dest=sys.stdout, **kwargs):
-        """Record all information of the current trial.
+    def record(self, **kwargs):
+        """Record all information of the current trial. The record is queued
+        in the order of RECORD_FIELDS and written out by the writer thread.
         """
-        if kwargs['session_trial'] == 0:
-            print(*[_.replace('_', '.') for _ in kwargs.keys()], file=dest, sep=',')
-        if self.mumble:
-            print(*[_.replace('_', '.') for _ in kwargs.keys()], file=sys.stderr, sep=',')
-            
-        print(*kwargs.values(), file=dest, sep=',')
-        if self.mumble:
-            print(*kwargs.values(), file=sys.stderr, sep=',')
+        record = tuple([kwargs[field] for field in RECORD_FIELDS])
+        self.store.append(record)
+        self.writer.put(record)
             
         #self.run_history.append({
         #        'whack_coordinates': self.mole.rel_whack_coordinates})
         
 
+# the design used by the demo
+ALL_MOLE_DISTS = [[0.6, 0.2, 0.1, 0.1],
+                  [0.2, 0.6, 0.1, 0.1],
+                  [0.1, 0.2, 0.6, 0.1],
+                  [0.1, 0.1, 0.2, 0.6]]
+ALL_ANIMAL_DISTS = [{'rabbit': 2, 'snail': 2, 'hippo': 2, 'dinosaur': 2}] * 4
+
+# the (mole dist, animal dist) pair sequence used in each block
+# instead of *3, which says 3 three blocks of the same sequence,
+# you can also list all blocks manually, if variation between blocks is needed
+# e.g., DIST_SEQ = [[(0,0), (1,0), (2,0)], [(1,0), (2,0), (0,0)]] - everything counts from 0
+# PAY SPECIAL ATTENTION TO THE DOUBLE BRACKETS - we want a nested list, each child list represents a block
+DIST_SEQ = [[(0,0), (1,0), (2,0), (0,0), (3,0), (1,0), (3,0), (2,0), (1,0), (0,0), (2,0), (3,0)]] * 3
+
+# the same applies to the bundle length sequence
+BUNDLE_LENGTH_SEQ = [[20, 25, 30, 25, 20, 20, 30, 20, 30, 30, 25, 25]] * 3
+
+# set a flag that determines if mole locations are sampled on the fly
+# or selected (randomly) from an exact-proportion list
+EXACT_PROPORTION = True
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser(description='Run the Whack-The-Mole experiment.')
     parser.add_argument('--subj', default = 'unknown', type=str, help='Specify a Subject ID for traceable output data')
     parser.add_argument('--mumble', action='store_true', help='Also prints out results to the screen. Note that this information is sent to standard error so it cannot be captured by redirecting using >')
+    parser.add_argument('--dirty-rects', action='store_true', help='Only redraw and update the regions of the screen that changed in each frame')
+    parser.add_argument('--flush-interval', default = None, type=float, help='Also flush the data file at least every so many seconds (0 flushes after every trial)')
+    parser.add_argument('--fsync', action='store_true', help='Force the data file to disk whenever it is flushed')
+    parser.add_argument('--columnar', action='store_true', help='Also write the data in a columnar binary file (.wtmc), which can be converted to CSV with wam_data.py')
+    parser.add_argument('--trajectory', action='store_true', help='Also record every mouse position with its time and trial in a columnar side file (.trajectory.wtmc)')
+    parser.add_argument('--profile', action='store_true', help='Time the phases of every frame and write their histograms and the missed frame deadlines to a .profile.csv file next to the data')
+    parser.add_argument('--audio-buffer', default = 256, type=int, help='Size of the mixer buffer in samples; smaller buffers play sounds sooner but may crackle')
+    parser.add_argument('--asset-pack', default = 'assets.pack', type=str, help='Load decoded images, text and sounds from this pack, built with wam_pack.py; loose files are used if it is missing or out of date')
+    parser.add_argument('--seed', default = None, type=int, help='Seed of the trial schedule, for reproducing a session. Drawn at random by default and saved in the schedule file')
     args = parser.parse_args()
 
+    sounds.pre_init(args.audio_buffer)
     pygame.init()
 
-    ALL_MOLE_DISTS = [[0.6, 0.2, 0.1, 0.1],
-                      [0.2, 0.6, 0.1, 0.1],
-                      [0.1, 0.2, 0.6, 0.1],
-                      [0.1, 0.1, 0.2, 0.6]]
-    ALL_ANIMAL_DISTS = [{'rabbit': 2, 'snail': 2, 'hippo': 2, 'dinosaur': 2}] * 4
-    
-    # the (mole dist, animal dist) pair sequence used in each block
-    # instead of *3, which says 3 three blocks of the same sequence,
-    # you can also list all blocks manually, if variation between blocks is needed
-    # e.g., DIST_SEQ = [[(0,0), (1,0), (2,0)], [(1,0), (2,0), (0,0)]] - everything counts from 0
-    # PAY SPECIAL ATTENTION TO THE DOUBLE BRACKETS - we want a nested list, each child list represents a block
-    DIST_SEQ = [[(0,0), (1,0), (2,0), (0,0), (3,0), (1,0), (3,0), (2,0), (1,0), (0,0), (2,0), (3,0)]] * 3
-
-    # the same applies to the bundle length sequence
-    BUNDLE_LENGTH_SEQ = [[20, 25, 30, 25, 20, 20, 30, 20, 30, 30, 25, 25]] * 3
-
-    # set a flag that determines if mole locations are sampled on the fly
-    # or selected (randomly) from an exact-proportion list
-    EXACT_PROPORTION = True
-    
     g = Game(
         mumble = args.mumble,
+        dirty_rects = args.dirty_rects,
+        seed = args.seed,
+        flush_interval = args.flush_interval,
+        fsync = args.fsync,
+        columnar = args.columnar,
+        trajectory = args.trajectory,
+        profile = args.profile,
+        asset_pack = args.asset_pack,
         subj_id = args.subj,
         dist_seq = DIST_SEQ, # the sequence of distributions implemented by each bundle; N = # of bundles
         bundle_length_seq = BUNDLE_LENGTH_SEQ, # the length of each bundle; N = # of bundles
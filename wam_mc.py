@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+"""Monte Carlo simulation of virtual participants over experiment designs.
+
+Instead of stepping the game, every virtual subject of a design is simulated
+at once with NumPy: the mole positions are drawn like Schedule does, a learner
+model predicts the next position from the past ones, and reaction times grow
+with how unexpected the position was. The results can be written in the layout
+of Game.record, or summarized per mole distribution and hole for power
+analyses. Sweeps over several designs and learners run in a process pool.
+"""
+
+from __future__ import print_function
+import sys, argparse
+from multiprocessing import Pool
+import numpy
+from wam import Design, Sampler
+from wam_data import RECORD_FIELDS
+
+class FrequencyLearner(object):
+    """Predicts the mole position from the counts of all past positions, with
+    a prior of alpha trials per hole.
+    """
+
+    def __init__(self, alpha = 1.):
+        self.alpha = alpha
+
+    def reset(self, n_subjects, design, n_holes):
+        self.counts = numpy.full((n_subjects, n_holes), self.alpha)
+
+    def predict(self):
+        return self.counts / self.counts.sum(1)[:, None]
+
+    def update(self, holes):
+        self.counts[numpy.arange(len(holes)), holes] += 1
+
+class RecencyLearner(FrequencyLearner):
+    """Like FrequencyLearner, but past positions are forgotten at a constant
+    rate: every trial the counts are multiplied by decay.
+    """
+
+    def __init__(self, decay = .9, alpha = 1.):
+        FrequencyLearner.__init__(self, alpha)
+        self.decay = decay
+
+    def update(self, holes):
+        self.counts = self.alpha + self.decay * (self.counts - self.alpha)
+        FrequencyLearner.update(self, holes)
+
+class BayesianLearner(object):
+    """An ideal observer that knows all the mole distributions of the design
+    and that the distribution may change after any trial with probability
+    hazard (by default, one over the mean bundle length). It predicts with
+    its posterior over the distribution in use.
+    """
+
+    def __init__(self, hazard = None):
+        self.hazard = hazard
+
+    def reset(self, n_subjects, design, n_holes):
+        self.dists = numpy.array(design.all_mole_dists, float)
+        self.dists /= self.dists.sum(1)[:, None]
+        lengths = [l for block in design.bundle_length_seq for l in block]
+        self.h = self.hazard if self.hazard is not None else len(lengths) / float(sum(lengths))
+        self.posterior = numpy.full((n_subjects, len(self.dists)), 1. / len(self.dists))
+
+    def _prior(self):
+        return (1 - self.h) * self.posterior + self.h / len(self.dists)
+
+    def predict(self):
+        return self._prior().dot(self.dists)
+
+    def update(self, holes):
+        posterior = self._prior() * self.dists[:, holes].T
+        self.posterior = posterior / posterior.sum(1)[:, None]
+
+LEARNERS = {'frequency': FrequencyLearner, 'recency': RecencyLearner, 'bayesian': BayesianLearner}
+
+class MonteCarloResult(object):
+    """The simulated trials of a design: trial-level columns shared by all
+    subjects (trials), plus one row per subject of holes, reaction times in
+    ms (NaN for misses) and scores.
+    """
+
+    def __init__(self, trials, holes, rts, scores):
+        self.trials, self.holes, self.rts, self.scores = trials, holes, rts, scores
+        self.n_subjects, self.n_trials = holes.shape
+
+def get_trial_table(design, warm_up = False):
+    """Lay out the trials of a design as Game.whack_session plays them, with
+    the record fields that do not depend on the subject.
+    """
+    columns = {}
+    dist_history, animal_dist_history = {}, {}
+    session_trial = 0
+    blocks = (['WARM_UP'] if warm_up else []) + range(design.num_of_blocks)
+    for block in blocks:
+        block_trial = 0
+        dist_history_block, animal_dist_history_block = {}, {}
+        for bundle_idx in design.get_bundle_range(block):
+            bundle_length, mole_dist, animal_dist, mole_dist_idx, animal_dist_idx = design.get_bundle_info(block, bundle_idx)
+            # the same statistics as whack_session
+            for history, idx in ((dist_history, mole_dist_idx), (dist_history_block, mole_dist_idx),
+                                 (animal_dist_history, animal_dist_idx), (animal_dist_history_block, animal_dist_idx)):
+                history[idx] = history[idx] + 1 if idx in history else 0
+            for bundle_trial in xrange(bundle_length):
+                row = dict(block = block, bundle = bundle_idx,
+                           session_trial = session_trial, block_trial = block_trial, bundle_trial = bundle_trial,
+                           hole0_design_prob = mole_dist[0], hole1_design_prob = mole_dist[1],
+                           hole2_design_prob = mole_dist[2], hole3_design_prob = mole_dist[3],
+                           bundle_length = bundle_length,
+                           rabbit_count = animal_dist['rabbit'], snail_count = animal_dist['snail'],
+                           dinosaur_count = animal_dist['dinosaur'], hippo_count = animal_dist['hippo'],
+                           mole_dist_freq = dist_history[mole_dist_idx], mole_dist_freq_block = dist_history_block[mole_dist_idx],
+                           animal_dist_freq = animal_dist_history[animal_dist_idx], animal_dist_freq_block = animal_dist_history_block[animal_dist_idx],
+                           mole_dist_idx = mole_dist_idx, animal_dist_idx = animal_dist_idx)
+                for field, value in row.items():
+                    columns.setdefault(field, []).append(value)
+                block_trial += 1
+                session_trial += 1
+    return columns
+
+def draw_holes(design, n_subjects, exact_proportion, rng, warm_up = False):
+    """Draw the mole positions of every subject, like Schedule does for one:
+    per bundle either a shuffled list with largest-remainder counts, or
+    independent draws.
+    """
+    bundles = []
+    blocks = (['WARM_UP'] if warm_up else []) + range(design.num_of_blocks)
+    for block in blocks:
+        for bundle_idx in design.get_bundle_range(block):
+            bundle_length, mole_dist = design.get_bundle_info(block, bundle_idx)[0:2]
+            p = numpy.array(mole_dist, float) / sum(mole_dist)
+            if exact_proportion:
+                quotas = bundle_length * p
+                counts = numpy.tile(numpy.floor(quotas).astype(int), (n_subjects, 1))
+                # hand out the remaining trials by largest remainder, ties at random
+                remainders = quotas - numpy.floor(quotas) + 1e-9 * rng.random_sample((n_subjects, len(p)))
+                order = numpy.argsort(-remainders, 1)
+                deficit = bundle_length - counts[0].sum()
+                counts[numpy.arange(n_subjects)[:, None], order[:, :deficit]] += 1
+                # lay out the holes in order and shuffle each subject's row
+                ends = counts.cumsum(1)
+                holes = (ends[:, None, :] <= numpy.arange(bundle_length)[None, :, None]).sum(2)
+                perm = numpy.argsort(rng.random_sample((n_subjects, bundle_length)), 1)
+                holes = holes[numpy.arange(n_subjects)[:, None], perm]
+            else:
+                sampler = Sampler(range(len(p)), p)
+                u = rng.random_sample((n_subjects, bundle_length)) * len(p)
+                i = u.astype(int)
+                holes = numpy.where(u - i < numpy.asarray(sampler.prob)[i], i, numpy.asarray(sampler.alias)[i])
+            bundles.append(holes)
+    return numpy.hstack(bundles).astype(numpy.int8)
+
+def simulate(design, learner, n_subjects = 1000, exact_proportion = True,
+             rt_base = 450., rt_surprise = 300., rt_sd = 80., lapse_rate = 0.,
+             max_rt = 2000., seed = None, warm_up = False):
+    """Simulate n_subjects virtual subjects playing a design. On every trial the
+    reaction time is rt_base + rt_surprise * (1 - predicted probability of the
+    hole) plus Gaussian noise with sd rt_sd; the mole is missed if the reaction
+    time exceeds max_rt, or with probability lapse_rate.
+    """
+    rng = numpy.random.RandomState(seed)
+    trials = get_trial_table(design, warm_up)
+    holes = draw_holes(design, n_subjects, exact_proportion, rng, warm_up)
+    n_holes = len(design.get_bundle_info(0, 0)[1])
+    learner.reset(n_subjects, design, n_holes)
+
+    rts = numpy.empty(holes.shape)
+    subjects = numpy.arange(n_subjects)
+    for t in xrange(holes.shape[1]):
+        surprise = 1 - learner.predict()[subjects, holes[:, t]]
+        rts[:, t] = rt_base + rt_surprise * surprise + rt_sd * rng.standard_normal(n_subjects)
+        learner.update(holes[:, t])
+    rts = numpy.maximum(rts, 1.)
+    rts[(rts > max_rt) | (rng.random_sample(rts.shape) < lapse_rate)] = numpy.nan
+    rts = numpy.round(rts)
+
+    # the same scoring as Mole.get_whacked
+    gains = numpy.where(numpy.isnan(rts), 0, (5000. / numpy.where(numpy.isnan(rts), 1, rts)).astype(int))
+    scores = gains.cumsum(1)
+    return MonteCarloResult(trials, holes, rts, scores)
+
+def write_records(result, dest = sys.stdout, subject_prefix = 'mc'):
+    """Write every simulated trial in the CSV layout of Game.record.
+    """
+    print(*[_.replace('_', '.') for _ in RECORD_FIELDS], file=dest, sep=',')
+    columns = [result.trials.get(field) for field in RECORD_FIELDS]
+    for s in xrange(result.n_subjects):
+        subject = '%s%04d' % (subject_prefix, s)
+        holes, rts, scores = result.holes[s].tolist(), result.rts[s].tolist(), result.scores[s].tolist()
+        for t in xrange(result.n_trials):
+            row = []
+            for field, column in zip(RECORD_FIELDS, columns):
+                if field == 'subject': row.append(subject)
+                elif field == 'reaction_time': row.append(None if rts[t] != rts[t] else int(rts[t]))
+                elif field == 'score': row.append(scores[t])
+                elif field == 'which_hole': row.append(holes[t])
+                elif column is None: row.append(None) # e.g. timestamps are not simulated
+                else: row.append(column[t])
+            print(*row, file=dest, sep=',')
+
+SUMMARY_FIELDS = ('design', 'learner', 'mole_dist_idx', 'which_hole', 'design_prob',
+                  'trials', 'hit_rate', 'mean_rt', 'sd_subject_rt')
+
+def summarize(result, design_name = '', learner_name = ''):
+    """Summarize the reaction times per mole distribution and hole: the hit
+    rate, the mean reaction time of the hits, and the standard deviation of
+    the subjects' mean reaction times (for power analyses).
+    """
+    rows = []
+    dist_idx = numpy.asarray(result.trials['mole_dist_idx'])
+    probs = numpy.array([result.trials['hole%d_design_prob' % i] for i in xrange(4)]).T
+    for d in sorted(set(dist_idx.tolist())):
+        for hole in xrange(probs.shape[1]):
+            mask = (dist_idx == d)[None, :] & (result.holes == hole)
+            trials = int(mask.sum())
+            if trials == 0: continue
+            rts = numpy.where(mask, result.rts, numpy.nan)
+            hits = ~numpy.isnan(rts)
+            with numpy.errstate(invalid = 'ignore'):
+                subject_means = numpy.nanmean(rts, 1) if hits.any() else numpy.array([numpy.nan])
+            rows.append(dict(design = design_name, learner = learner_name,
+                             mole_dist_idx = d, which_hole = hole,
+                             design_prob = probs[dist_idx == d][0, hole],
+                             trials = trials, hit_rate = hits.sum() / float(trials),
+                             mean_rt = numpy.nanmean(rts[hits]) if hits.any() else None,
+                             sd_subject_rt = numpy.nanstd(subject_means)))
+    return rows
+
+def write_summary(rows, dest = sys.stdout):
+    print(*[_.replace('_', '.') for _ in SUMMARY_FIELDS], file=dest, sep=',')
+    for row in rows:
+        print(*[row[field] for field in SUMMARY_FIELDS], file=dest, sep=',')
+
+def _run_job(job):
+    name, design_args, learner_name, learner_args, sim_args = job
+    design = Design(*design_args)
+    result = simulate(design, LEARNERS[learner_name](**learner_args), **sim_args)
+    return summarize(result, name, learner_name)
+
+def sweep(designs, learners, processes = None, **sim_args):
+    """Simulate every combination of designs and learners in a process pool and
+    return the summary rows of all of them. designs maps names to the arguments
+    of Design, and learners maps learner names (keys of LEARNERS) to the
+    arguments of the learner.
+    """
+    jobs = [(name, design_args, learner_name, learner_args, sim_args)
+            for name, design_args in sorted(designs.items())
+            for learner_name, learner_args in sorted(learners.items())]
+    pool = Pool(processes)
+    try:
+        results = pool.map(_run_job, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    return [row for rows in results for row in rows]
+
+if __name__ == '__main__':
+
+    from wam_demo import ALL_MOLE_DISTS, ALL_ANIMAL_DISTS, DIST_SEQ, BUNDLE_LENGTH_SEQ, EXACT_PROPORTION
+
+    parser = argparse.ArgumentParser(description='Simulate virtual participants playing the demo design with every learner model.')
+    parser.add_argument('--subjects', default = 1000, type=int, help='The number of virtual subjects per design and learner')
+    parser.add_argument('--rt-base', default = 450., type=float, help='Reaction time in ms to a fully expected mole')
+    parser.add_argument('--rt-surprise', default = 300., type=float, help='Extra reaction time in ms to a fully unexpected mole')
+    parser.add_argument('--rt-sd', default = 80., type=float, help='Standard deviation of the reaction time noise in ms')
+    parser.add_argument('--lapse-rate', default = 0., type=float, help='Probability of missing a mole regardless of the reaction time')
+    parser.add_argument('--processes', default = None, type=int, help='Size of the process pool; one per core by default')
+    parser.add_argument('--seed', default = 0, type=int, help='Seed of the simulations')
+    args = parser.parse_args()
+
+    designs = {'demo': (DIST_SEQ, BUNDLE_LENGTH_SEQ, ALL_MOLE_DISTS, ALL_ANIMAL_DISTS)}
+    learners = dict((name, {}) for name in LEARNERS)
+    rows = sweep(designs, learners, args.processes,
+                 n_subjects = args.subjects, exact_proportion = EXACT_PROPORTION,
+                 rt_base = args.rt_base, rt_surprise = args.rt_surprise, rt_sd = args.rt_sd,
+                 lapse_rate = args.lapse_rate, seed = args.seed)
+    write_summary(rows)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+"""Build the asset pack of the game: every image at the scales the game shows
+it, as raw pixels, the text it renders, and its sound effects decoded to PCM
+in the mixer format, all in one file. The game memory-maps the pack at
+startup instead of decoding PNGs, rendering fonts and decoding sounds, and
+falls back to the loose files if the pack is missing or older than any of
+its sources. Rebuild it whenever an image, font or sound changes:
+
+    python wam_pack.py
+
+The background music is streamed from disk and is not packed.
+"""
+
+from __future__ import print_function
+import os
+# building the pack must not open a window or an audio device
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from wam_demo import *
+import argparse
+
+def text_manifest():
+    """Return the (font path, size, text, color, antialias) of all the text
+    the game renders ahead of a session.
+    """
+    color = (0,0,0)
+    keys = [ScoreBar.FONT + (text, color, True) for text in ['Score: '] + list('0123456789')]
+    for text in [Game.READY_MESSAGE] + [str(i + 1) for i in xrange(Game.COUNTDOWN)]:
+        keys.append(Game.COUNTDOWN_FONT + (text, color, True))
+    return keys
+
+class PackBuilder(object):
+    """Collects the entries of an asset pack and writes it out.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.chunks = []
+        self.offset = 0
+        self.sources = {}
+
+    def add(self, key, sources, data, size = None, format = None):
+        entry = {'key': list(key), 'offset': self.offset, 'length': len(data)}
+        if size is not None: entry.update(size = list(size), format = format)
+        self.entries.append(entry)
+        # keep every entry aligned to 8 bytes
+        padding = -len(data) % 8
+        self.chunks.append(data + b'\0' * padding)
+        self.offset += len(data) + padding
+        for path in sources:
+            st = os.stat(path)
+            self.sources[path] = [st.st_size, int(st.st_mtime)]
+
+    def add_surface(self, key, source, surface, format):
+        self.add(key, [source], pygame.image.tostring(surface, format), surface.get_size(), format)
+
+    def write(self, path):
+        header = json.dumps({'entries': self.entries, 'sources': self.sources}, sort_keys = True).encode('utf-8')
+        # offsets are relative to the data, which starts 8-byte aligned
+        padding = -(len(AssetPack.MAGIC) + 4 + len(header)) % 8
+        header += b' ' * padding
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(AssetPack.MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for chunk in self.chunks:
+                f.write(chunk)
+        os.rename(tmp, path)
+        return self.offset
+
+def build(path):
+    """Decode all assets of the game and write them to the pack at path.
+    """
+    sounds.pre_init()
+    pygame.init()
+    pygame.display.set_mode(Game.SCREEN_SIZE, 0, 32)
+    builder = PackBuilder()
+    for image_path, scale, alpha in image_manifest():
+        builder.add_surface(('image', image_path, scale, alpha), image_path,
+                            assets.image(image_path, scale, alpha), 'RGBA' if alpha else 'RGB')
+    for key in text_manifest():
+        builder.add_surface(('text',) + key, key[0], texts.render(*key), 'RGBA')
+    mixer = pygame.mixer.get_init()
+    if mixer is None:
+        print('no audio device: sounds are not packed', file=sys.stderr)
+    else:
+        for sound_path in SoundBank.EFFECTS:
+            builder.add(('sound', sound_path, mixer), [sound_path], sounds.get(sound_path).get_raw())
+    size = builder.write(path)
+    print('packed', len(builder.entries), 'assets,', size // 1024, 'KB, into', path, file=sys.stderr)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build the asset pack of decoded images, text and sounds that the Whack-The-Mole game loads at startup.')
+    parser.add_argument('--output', default = 'assets.pack', type=str, help='Where the pack is written')
+    args = parser.parse_args()
+
+    build(args.output)
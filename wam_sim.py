@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+"""Run the Whack-The-Mole game headless: no window, no sound and a virtual
+clock, with simulated players clicking on the moles. Sessions run as fast as
+the game logic allows, e.g. for regression tests or for dry runs of designs.
+"""
+
+from __future__ import print_function
+import os
+# the game must not open a window or an audio device
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from wam_demo import *
+import argparse, random
+
+class ScriptedPlayer(object):
+    """A player that clicks at given positions at given times of the virtual
+    clock, from a list of (seconds, x, y).
+    """
+
+    def __init__(self, clicks):
+        self.clicks = sorted(clicks)
+
+    def __call__(self, world, now):
+        while self.clicks and self.clicks[0][0] <= now:
+            t, x, y = self.clicks.pop(0)
+            post_click(x, y, t)
+
+class ModelPlayer(object):
+    """A player that misses a mole with probability miss_rate, and otherwise
+    clicks on its center after a normally distributed reaction time (in ms)
+    counted from the onset of the mole.
+    """
+
+    def __init__(self, rt_mean = 500., rt_sd = 100., miss_rate = 0., seed = None):
+        self.rt_mean, self.rt_sd, self.miss_rate = rt_mean, rt_sd, miss_rate
+        self.rng = random.Random(seed)
+        self.trial = None # begin time of the current mole
+        self.click_time = None
+
+    def __call__(self, world, now):
+        mole = world.mole
+        if mole is None or not mole.visible: return
+        if mole.begin_time != self.trial:
+            self.trial = mole.begin_time
+            self.click_time = None
+            if self.rng.random() >= self.miss_rate:
+                rt = max(0., self.rng.gauss(self.rt_mean, self.rt_sd))
+                onset = now if mole.onset_time is None else mole.onset_time
+                self.click_time = onset + rt / 1000.
+        if self.click_time is not None and now >= self.click_time:
+            x, y, w, h = mole.rect
+            post_click(x + w // 2, y + h // 2, self.click_time)
+            self.click_time = None
+
+def post_click(x, y, t):
+    """Post a click at (x, y) that happened at time t of the virtual clock.
+    """
+    pygame.event.post(pygame.event.Event(MOUSEBUTTONDOWN, pos = (x, y), button = 1, timestamp = t * 1000.))
+
+def simulate(player, subj_id = 'sim', warm_up = False,
+             dist_seq = DIST_SEQ, bundle_length_seq = BUNDLE_LENGTH_SEQ,
+             all_mole_dists = ALL_MOLE_DISTS, all_animal_dists = ALL_ANIMAL_DISTS,
+             exact_proportion = EXACT_PROPORTION, **kwargs):
+    """Play a whole session headless with a simulated player, which is called
+    with (world, now) after every frame. Other keyword arguments are passed on
+    to Game. Return the game, whose store holds all trials.
+    """
+    pygame.init()
+    # animal placement draws from the global random stream
+    random.seed(kwargs.get('seed'))
+    g = Game(subj_id = subj_id,
+             dist_seq = dist_seq, bundle_length_seq = bundle_length_seq,
+             all_mole_dists = all_mole_dists, all_animal_dists = all_animal_dists,
+             exact_proportion = exact_proportion,
+             headless = True, **kwargs)
+    g.world.clock.on_tick = lambda now: player(g.world, now)
+
+    if warm_up: g.whack_session(block = 'WARM_UP')
+    for block in xrange(g.num_of_blocks):
+        g.whack_session(block = block)
+    g.close()
+    return g
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run headless Whack-The-Mole sessions with simulated players.')
+    parser.add_argument('--runs', default = 1, type=int, help='The number of sessions to simulate')
+    parser.add_argument('--rt-mean', default = 500., type=float, help='Mean reaction time of the simulated players in ms')
+    parser.add_argument('--rt-sd', default = 100., type=float, help='Standard deviation of the reaction times in ms')
+    parser.add_argument('--miss-rate', default = 0., type=float, help='Probability that a simulated player misses a mole')
+    parser.add_argument('--seed', default = 0, type=int, help='Seed of the first session; session i uses seed + i')
+    parser.add_argument('--data-dir', default = '.', type=str, help='Where the data files are written')
+    args = parser.parse_args()
+
+    for run in xrange(args.runs):
+        seed = args.seed + run
+        player = ModelPlayer(args.rt_mean, args.rt_sd, args.miss_rate, seed)
+        g = simulate(player, subj_id = 'sim%04d' % seed, seed = seed, data_dir = args.data_dir)
+        print('session', seed, 'trials', g.store.n, 'hit rate', g.store.get_hit_rate(),
+              'score', g.store.score, 'virtual time', g.world.clock.time(), file=sys.stderr)